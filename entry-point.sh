@@ -6,4 +6,22 @@
 
 cron &
 (cd /sql-training; python manage.py collectstatic --no-input)
+if [ -n "$PG_STUD_BROKER" ]; then
+    rm -f "$PG_STUD_BROKER"
+    # restarted when it exits
+    (
+        cd /sql-training
+        while true; do
+            python manage.py runbroker
+            echo "pg_stud broker exited with $?, restarting" >&2
+            sleep 1
+        done
+    ) &
+    # the workers need the socket
+    for _ in $(seq 60); do
+        [ -S "$PG_STUD_BROKER" ] && break
+        sleep 1
+    done
+    [ -S "$PG_STUD_BROKER" ] || echo "pg_stud broker did not start" >&2
+fi
 python -m gunicorn sql_training.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --workers=2 
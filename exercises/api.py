@@ -6,12 +6,12 @@ from typing import List, Optional
 
 from django.db import models
 from django.db.models.functions import Coalesce
-from django.http import HttpRequest
-from django.shortcuts import get_list_or_404, get_object_or_404
+from django.http import Http404, HttpRequest
 from ninja import Query, Router, Schema
 
 from exercises import models as m
 from exercises import schemas as s
+from exercises.catalog import get_catalog
 from exercises.filter_api import router as filter_router
 from exercises.stats_api import router as stats_router
 from ltiapi.models import LTIUser
@@ -22,6 +22,13 @@ router.add_router("filter", filter_router)
 router.add_router("stats", stats_router)
 
 
+def not_empty(objects: List) -> List:
+    """Like get_list_or_404 for the lists of the catalog"""
+    if not objects:
+        raise Http404("No objects match the given query.")
+    return objects
+
+
 @router.get("userdata", response=s.Userdata)
 def get_userdata(request: HttpRequest):
     """Returns username of current user."""
@@ -40,60 +47,53 @@ def get_userdata(request: HttpRequest):
 @router.get("/topic/{topic_short}", response=s.Topic)
 def get_topic(request: HttpRequest, topic_short):
     """Returns topic fields for topic_short."""
-    topic = get_object_or_404(m.Topic, short=topic_short, visible=True)
-    return topic
+    return get_catalog().topic(topic_short, visible_only=True)
 
 
 @router.get("/ttags", response=List[s.Ttag])
 def list_ttag(request: HttpRequest):
     """Returns a list of all topic tags."""
-    return m.Ttag.objects.all()
+    return get_catalog().ordered(m.Ttag)
 
 
 @router.get("/list_topics", response=List[s.Topic])
 def list_topic(request):
     """Returns a list of all topics."""
-    return m.Topic.objects.filter(visible=True)
+    return [topic for topic in get_catalog().ordered(m.Topic) if topic.visible]
 
 
 @router.get("/etags", response=List[s.Etag])
 def list_etag(request: HttpRequest):
     """Returns a list of all exercise tags."""
-    return m.Etag.objects.all()
+    return get_catalog().ordered(m.Etag)
 
 
 @router.get("/exercise/{topic_short}/{enumber}", response=s.Exercise)
 def get_exercise(request, topic_short: str, enumber: int):
     """Returns exercise field by enumber and topic_short."""
-    exercise = get_object_or_404(
-        m.Exercise, topic=topic_short, topic__visible=True, enumber=enumber
-    )
-    return exercise
+    return get_catalog().exercise(topic_short, enumber, visible_only=True)
 
 
 @router.get("/list_exercises", response=List[s.ExerciseItem])
 def list_exercise(request: HttpRequest, topic_short: Optional[str] = None):
     """Returns a list of all exercises optionally filtered by topic_short."""
+    exercises = get_catalog().ordered(m.Exercise)
     if topic_short:
-        return get_list_or_404(
-            m.Exercise,
-            topic=topic_short,
-            topic__visible=True,
+        return not_empty(
+            [e for e in exercises if e.topic_id == topic_short and e.topic.visible]
         )
-    return m.Exercise.objects.all()
+    return exercises
 
 
 @router.get("/solution/{topic_short}/{enumber}/{snumber}", response=s.Solution)
 def get_solution(request, topic_short: str, enumber: int, snumber: int):
     """Return solution fields by snumber, enumber, topic_short"""
-    solution = get_object_or_404(
-        m.Solution,
-        exercise__topic=topic_short,
-        exercise__topic__visible=True,
-        exercise__enumber=enumber,
-        snumber=snumber,
-    )
-    return solution
+    catalog = get_catalog()
+    exercise = catalog.exercise(topic_short, enumber, visible_only=True)
+    for solution in catalog.of_exercise.get(exercise.pk, []):
+        if solution.snumber == snumber:
+            return solution
+    raise Http404("No Solution matches the given query.")
 
 
 @router.get("/solutions", response=List[s.Solution])
@@ -101,24 +101,25 @@ def list_solution(
     request, topic_short: Optional[str] = None, enumber: Optional[int] = None
 ):
     """Return all solutions optionally filtered by enumber and topic_short."""
+    solutions = get_catalog().ordered(m.Solution)
     if topic_short:
+        solutions = [o for o in solutions if o.exercise.topic_id == topic_short]
         if enumber:
-            return get_list_or_404(
-                m.Solution,
-                exercise__topic=topic_short,
-                exercise__topic__visible=True,
-                exercise__enumber=enumber,
+            return not_empty(
+                [
+                    o
+                    for o in solutions
+                    if o.exercise.enumber == enumber and o.exercise.topic.visible
+                ]
             )
-        return get_list_or_404(m.Solution, exercise__topic=topic_short)
-    return m.Solution.objects.all()
+        return not_empty(solutions)
+    return solutions
 
 
 @router.get("/user_exercise/{topic_short}/{enumber}", response=s.UserExercise)
 def get_user_exercise(request, topic_short: str, enumber: int):
     """Return user data for exercise by enumber and topic_short."""
-    exercise = get_object_or_404(
-        m.Exercise, topic=topic_short, enumber=enumber, topic__visible=True
-    )
+    exercise = get_catalog().exercise(topic_short, enumber, visible_only=True)
     user_exercise, _ = m.UserExercise.objects.get_or_create(
         user=request.user,
         exercise=exercise,
@@ -148,9 +149,7 @@ class UserExerciseIn(Schema):
 @router.patch("/user_exercise")
 def patch_user_exercise(request, topic_short: str, enumber: int, data: UserExerciseIn):
     """Patches current user's exercise (topic_short, enumber) by provided data."""
-    exercise = get_object_or_404(
-        m.Exercise, topic=topic_short, enumber=enumber, topic__visible=True
-    )
+    exercise = get_catalog().exercise(topic_short, enumber, visible_only=True)
     defaults = {k: v for k, v in data.dict().items() if v is not None}
 
     m.UserExercise.objects.update_or_create(
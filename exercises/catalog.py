@@ -0,0 +1,163 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module caches the catalog of topics, exercises, solutions and tags.
+
+The catalog only changes when a lecturer edits it in the admin, but nearly
+every request reads it. Every process keeps the whole catalog in memory, the
+instances carry all translations. Saving or deleting a part of it changes the
+version in the cache shared by the workers, see signals. A process compares
+its version with the shared one at most every CATALOG_CHECK_INTERVAL seconds
+and loads the catalog again when it changed.
+
+The orders of the lists depend on the language, e.g. topics are ordered by
+their translated title, so they are taken from the database once per version
+and language.
+"""
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple, Type
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.http import Http404
+from django.utils.translation import get_language
+
+from exercises import models as m
+
+VERSION_KEY = "exercises:catalog:version"
+
+
+def shared_version() -> str:
+    """Returns the version of the catalog in the shared cache"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # also after an eviction, which may have hidden a change
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+class Catalog:
+    """Topics, exercises, solutions and tags of one version"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.ttags = {t.pk: t for t in m.Ttag.objects.all()}
+        self.etags = {t.pk: t for t in m.Etag.objects.all()}
+        self.topics = {t.pk: t for t in m.Topic.objects.select_related("tag")}
+        self.exercises: Dict[int, m.Exercise] = {}
+        self.numbers: Dict[Tuple[str, int], m.Exercise] = {}
+        for exercise in m.Exercise.objects.prefetch_related("tags"):
+            exercise.topic = self.topics[exercise.topic_id]
+            self.exercises[exercise.pk] = exercise
+            self.numbers[(exercise.topic_id, exercise.enumber)] = exercise
+        self.solutions: Dict[int, m.Solution] = {}
+        # solutions of every exercise ordered by snumber
+        self.of_exercise: Dict[int, List[m.Solution]] = {}
+        for solution in m.Solution.objects.order_by("snumber"):
+            solution.exercise = self.exercises[solution.exercise_id]
+            self.solutions[solution.pk] = solution
+            self.of_exercise.setdefault(solution.exercise_id, []).append(solution)
+        self._lock = threading.Lock()
+        self._orders: Dict[Tuple[Type[models.Model], str], List] = {}
+
+    def ordered(self, model: Type[models.Model]) -> List:
+        """Returns all instances of the model in its order in the current
+        language"""
+        instances = {
+            m.Ttag: self.ttags,
+            m.Etag: self.etags,
+            m.Topic: self.topics,
+            m.Exercise: self.exercises,
+            m.Solution: self.solutions,
+        }[model]
+        key = (model, get_language())
+        with self._lock:
+            order = self._orders.get(key)
+        if order is None:
+            order = list(model.objects.values_list("pk", flat=True))
+            with self._lock:
+                self._orders[key] = order
+        # created after the catalog was loaded
+        return [instances[pk] for pk in order if pk in instances]
+
+    def topic(self, short: str, visible_only=False) -> m.Topic:
+        """Returns the topic or raises Http404"""
+        topic = self.topics.get(short)
+        if topic is None or (visible_only and not topic.visible):
+            raise Http404("No Topic matches the given query.")
+        return topic
+
+    def exercise(
+        self, topic_short: str, enumber: int, visible_only=False
+    ) -> m.Exercise:
+        """Returns the exercise or raises Http404"""
+        exercise = self.numbers.get((topic_short, int(enumber)))
+        if exercise is None or (visible_only and not exercise.topic.visible):
+            raise Http404("No Exercise matches the given query.")
+        return exercise
+
+    def first_solution(self, exercise: m.Exercise) -> Optional[m.Solution]:
+        """Returns the solution of the exercise with the lowest snumber"""
+        return next(iter(self.of_exercise.get(exercise.pk, [])), None)
+
+    def changes(self, topic: m.Topic) -> List[m.Solution]:
+        """Returns the solutions with snumber 1 of the topic's non-SELECT
+        exercises ordered by enumber"""
+        exercises = sorted(
+            (e for e in self.exercises.values() if e.topic_id == topic.pk),
+            key=lambda exercise: exercise.enumber,
+        )
+        return [
+            solution
+            for exercise in exercises
+            if not exercise.is_select
+            for solution in self.of_exercise.get(exercise.pk, [])[:1]
+            if solution.snumber == 1
+        ]
+
+
+class CatalogCache:
+    """The catalog of the process, loaded again when the version changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalog: Optional[Catalog] = None
+        self._checked = 0.0
+        # changes of the process while a catalog is loaded
+        self._generation = 0
+
+    def get(self) -> Catalog:
+        """Returns the catalog, loaded again if the shared version changed"""
+        now = time.monotonic()
+        with self._lock:
+            catalog, generation = self._catalog, self._generation
+            if catalog and now - self._checked < settings.CATALOG_CHECK_INTERVAL:
+                return catalog
+
+        version = shared_version()
+        if not catalog or catalog.version != version:
+            catalog = Catalog(version)
+        with self._lock:
+            if generation == self._generation:
+                self._catalog, self._checked = catalog, now
+        return catalog
+
+    def invalidate(self) -> None:
+        """Drops the catalog of all processes"""
+        with self._lock:
+            self._catalog = None
+            self._generation += 1
+        cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+catalog = CatalogCache()
+
+
+def get_catalog() -> Catalog:
+    """Returns the catalog of topics, exercises, solutions and tags"""
+    return catalog.get()
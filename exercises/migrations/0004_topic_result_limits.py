@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("exercises", "0003_alter_topic_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="topic",
+            name="max_bytes",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Maximum size in bytes of a query result sent to students.            If empty PG_STUD_MAX_BYTES is used.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="topic",
+            name="max_rows",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Maximum number of rows of a query result sent to students.            If empty PG_STUD_MAX_ROWS is used.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("exercises", "0004_topic_result_limits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exercise",
+            name="lock_timeout",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Milliseconds, 0 disables the timeout", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="exercise",
+            name="statement_timeout",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Milliseconds, 0 disables the timeout", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="exercise",
+            name="temp_file_limit",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Kilobytes, 0 for the server's default", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="exercise",
+            name="work_mem",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Kilobytes, 0 for the server's default", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="topic",
+            name="lock_timeout",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Milliseconds, 0 disables the timeout", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="topic",
+            name="statement_timeout",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Milliseconds, 0 disables the timeout", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="topic",
+            name="temp_file_limit",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Kilobytes, 0 for the server's default", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="topic",
+            name="work_mem",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Kilobytes, 0 for the server's default", null=True
+            ),
+        ),
+    ]
@@ -23,7 +23,29 @@ class Ttag(models.Model):
     name = models.CharField(max_length=20, primary_key=True)
 
 
-class Topic(models.Model):
+class ResourceLimits(models.Model):
+    """Settings of the transactions of student queries. Empty settings of an
+    exercise are taken from its topic, empty settings of a topic from the
+    PG_STUD_* defaults."""
+
+    statement_timeout = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Milliseconds, 0 disables the timeout"
+    )
+    lock_timeout = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Milliseconds, 0 disables the timeout"
+    )
+    work_mem = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Kilobytes, 0 for the server's default"
+    )
+    temp_file_limit = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Kilobytes, 0 for the server's default"
+    )
+
+    class Meta:
+        abstract = True
+
+
+class Topic(ResourceLimits):
     # Primary keys cannot be translated
     short = models.SlugField(
         max_length=10, primary_key=True, help_text="Not translated primary key"
@@ -41,6 +63,18 @@ class Topic(models.Model):
         help_text="This script get executed when the datamodel is being installed\
               or reseted.\n It must contain the DDL and insert statements for each tables.",
     )
+    max_rows = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Maximum number of rows of a query result sent to students.\
+            If empty PG_STUD_MAX_ROWS is used.",
+    )
+    max_bytes = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Maximum size in bytes of a query result sent to students.\
+            If empty PG_STUD_MAX_BYTES is used.",
+    )
 
     def __str__(self) -> str:
         return f"{self.short}"
@@ -64,7 +98,7 @@ class ExerciseManager(models.Manager):
         return self.get(topic=topic, enumber=enumber)
 
 
-class Exercise(models.Model):
+class Exercise(ResourceLimits):
     class Difficulty(models.IntegerChoices):
         EASY = 1
         NORMAL = 2
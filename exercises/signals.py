@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module drops the cached catalog when a part of it changes"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from exercises import models as m
+from exercises.catalog import catalog
+
+
+def catalog_changed(sender, **kwargs):
+    """Dropped at once for the process and again after the commit, as other
+    workers may load the old catalog until then"""
+    catalog.invalidate()
+    transaction.on_commit(catalog.invalidate)
+
+
+for model in (m.Ttag, m.Etag, m.Topic, m.Exercise, m.Solution):
+    post_save.connect(catalog_changed, sender=model)
+    post_delete.connect(catalog_changed, sender=model)
+m2m_changed.connect(catalog_changed, sender=m.Exercise.tags.through)
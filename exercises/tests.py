@@ -5,9 +5,13 @@
 import unittest
 from functools import reduce
 
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.http import Http404
+from django.test import Client, TestCase, override_settings
+from django.utils import translation
 
 import exercises.models as m
+from exercises.catalog import VERSION_KEY, catalog, get_catalog
 from ltiapi.models import LTIUser
 
 # Create your tests here.
@@ -446,3 +450,35 @@ class UserData(TestCase):
         expected_data = {"total": 3, "started": 0, "correct": 1, "wrong": 1}
         self.assertEqual(response.json(), expected_data)
         # filtering was tested above.
+
+
+class Catalog(TestCase):
+    fixtures = [
+        "common_test.yaml",
+        "pc_test.yaml",
+    ]
+
+    def setUp(self):
+        # the catalog may have been loaded before a rollback
+        catalog.invalidate()
+
+    def test_catalog(self):
+        topic = get_catalog().topic("pc")
+        exercise = get_catalog().exercise("pc", 1)
+        with self.assertNumQueries(0):
+            self.assertIs(exercise.topic, topic)
+            self.assertEqual(get_catalog().first_solution(exercise).snumber, 1)
+            with translation.override("de"):
+                self.assertEqual(topic.title, "Bildersammlung")
+        self.assertRaises(Http404, get_catalog().exercise, "pc", 99)
+
+        # saved in the admin
+        topic.title_en = "Photos"
+        topic.save()
+        self.assertEqual(get_catalog().topic("pc").title_en, "Photos")
+
+        # changed by another worker
+        m.Topic.objects.filter(short="pc").update(title_en="Pictures")
+        with override_settings(CATALOG_CHECK_INTERVAL=0):
+            cache.set(VERSION_KEY, "other")
+            self.assertEqual(get_catalog().topic("pc").title_en, "Pictures")
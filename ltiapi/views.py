@@ -35,6 +35,8 @@ from pylti1p3.contrib.django import (
 from pylti1p3.contrib.django.lti1p3_tool_config import DjangoDbToolConf
 from pylti1p3.deep_link_resource import DeepLinkResource
 
+from pg_stud.api import warm_up_student
+from pg_stud.offload import submit
 from sql_training.settings import config
 from sql_training.utils import absolute_reverse
 
@@ -206,6 +208,10 @@ def lti_launch(request: HttpRequest):
         request.session.set_expiry(0)
         # request.session["course_ids"] = allowed_course_ids
 
+        # open the pool of the user while the frontend is loading
+        if settings.PG_STUD_WARM_UP != "off":
+            submit(warm_up_student, request)
+
         return redirect("/")
 
     return HttpResponseBadRequest(_("Unknown or unsupported message type provided."))
@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module provides the admission control of the pg_stud views.
+
+The views are of a kind of PG_STUD_ADMISSION, e.g. cheap "query" views and
+expensive "check" views. At most "concurrency" views of a kind run at once per
+process and every student has a token bucket of "burst" tokens refilled with
+"rate" tokens per second. Requests over the limits are rejected at once with
+a Throttled exception, answered with 429 and Retry-After, instead of queueing
+for a connection.
+"""
+import math
+import threading
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from django.conf import settings
+from django.http import HttpRequest
+
+# buckets are pruned when there are more
+MAX_BUCKETS = 10000
+
+
+class Throttled(Exception):
+    """The request was rejected by the admission control"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after:.1f} seconds")
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        return Throttled, (self.retry_after,)
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Token bucket of burst tokens refilled with rate tokens per second.
+    It holds at least one token, else no request would ever be admitted."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self) -> float:
+        """Takes a token. Returns 0 if there was one, else the seconds until
+        the next token."""
+        self._refill(time.monotonic())
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self._tokens >= self.burst
+
+
+class Admission:
+    """Concurrency limits and token buckets of the kinds of views"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running: Dict[str, int] = {}
+        self._buckets: Dict[Tuple[str, Hashable], TokenBucket] = {}
+
+    def enter(self, kind: str, user: Hashable) -> None:
+        """Admits a request of the user or raises Throttled"""
+        limits = settings.PG_STUD_ADMISSION[kind]
+        with self._lock:
+            running = self._running.get(kind, 0)
+            if limits["concurrency"] and running >= limits["concurrency"]:
+                raise Throttled(1)
+            if limits["rate"]:
+                wait = self._bucket(kind, user, limits).take()
+                if wait:
+                    raise Throttled(wait)
+            self._running[kind] = running + 1
+
+    def exit(self, kind: str) -> None:
+        with self._lock:
+            self._running[kind] -= 1
+
+    def _bucket(self, kind: str, user: Hashable, limits: Dict[str, Any]) -> TokenBucket:
+        """Returns the bucket of the user. Must be called with _lock held."""
+        key = (kind, user)
+        bucket = self._buckets.get(key)
+        if not bucket:
+            if len(self._buckets) >= MAX_BUCKETS:
+                # full buckets are the same as new ones
+                for full in [k for k, b in self._buckets.items() if b.is_full()]:
+                    del self._buckets[full]
+            bucket = self._buckets[key] = TokenBucket(limits["rate"], limits["burst"])
+        return bucket
+
+
+admission = Admission()
+
+
+def admit(kind: str):
+    """Applies the admission control of the kind to an async view"""
+
+    def decorator(view: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @wraps(view)
+        async def admitted_view(request: HttpRequest, *args, **kwargs):
+            # the user was loaded by the authentication
+            admission.enter(kind, request.user.pk)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                admission.exit(kind)
+
+        return admitted_view
+
+    return decorator
@@ -2,13 +2,21 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from typing import Tuple
+
+from django.conf import settings
 from django.http import HttpRequest
-from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext_lazy as _
 from ninja import Router
+from psycopg_pool import PoolTimeout
 
 from exercises import models as m
-from pg_stud.evaluation import check_mand_deny_list, check_results
+from exercises.catalog import get_catalog
+from ltiapi.models import LTIUser
+from pg_stud.admission import admit
+from pg_stud.evaluation import check_mand_deny_list, evaluate
+from pg_stud.metrics_api import router as metrics_router
+from pg_stud.offload import async_django_auth, brokered, offload
 from pg_stud.pg_conn_pool import PgConnPool
 from pg_stud.schemas import (
     CheckAnswerOut,
@@ -18,63 +26,64 @@ from pg_stud.schemas import (
     QueryOut,
     Result,
 )
+from pg_stud.single_flight import SingleFlight
+from pg_stud.solution_cache import get_solution_result
 from pg_stud.utils import (
+    Rows,
     do_reset_db,
+    ensure_installed,
     execute,
-    execute_check,
-    install_db,
-    is_installed,
     update_user_exercise,
+    warm_up,
 )
 
-router = Router()
+# the views are async, see offload
+router = Router(auth=async_django_auth)
+router.add_router("metrics", metrics_router)
+
+checks: SingleFlight[Tuple[Result, Result, bool]] = SingleFlight()
 
 
 @router.post("execute_query/", response=QueryOut)
+@admit("query")
+@offload
 def execute_query(request: HttpRequest, data: QueryIn):
     """Executes Query without checking correctness and saves buffer
     Does not reset DB
     """
-    topic = get_object_or_404(m.Topic, short=data.topic_short)
-    exercise = get_object_or_404(m.Exercise, topic=topic, enumber=data.enumber)
+    topic = get_catalog().topic(data.topic_short)
+    exercise = get_catalog().exercise(topic.short, data.enumber)
     user_query = data.query
 
-    with PgConnPool().get_pool(request.user).connection() as conn:
-        query_result = execute(conn, user_query, topic)
+    with PgConnPool().connection(request.user) as conn:
+        query_result = execute(conn, user_query, topic, exercise=exercise)
 
     update_user_exercise(request.user, exercise, user_query)
 
-    return QueryOut(result=Result(result=query_result))
+    return QueryOut(
+        result=Result(result=query_result, truncated=query_result.truncated)
+    )
 
 
 @router.post("check_answer_correct/", response=CheckAnswerOut)
+@admit("check")
+@offload
 def check_answer_correct_api(request: HttpRequest, data: QueryIn):
     """Executes Query with checking correctness, saves buffer and correctness
-    This also resets the DB.
+    This also resets the DB. Reset and evaluation share one connection.
+    With PG_STUD_CHECK_MODE "rollback" the queries run in a transaction which
+    is rolled back. SELECT exercises then run in a READ ONLY transaction and
+    only reset a schema which was modified.
     """
-    topic = get_object_or_404(m.Topic, short=data.topic_short)
-    exercise = get_object_or_404(m.Exercise, topic=topic, enumber=data.enumber)
+    topic = get_catalog().topic(data.topic_short)
+    exercise = get_catalog().exercise(topic.short, data.enumber)
     user_query = data.query
 
-    # Reset DB
-    with PgConnPool().get_pool(request.user).connection() as conn:
-        do_reset_db(conn, topic, exercise)
-
-    # Execute user query
-    with PgConnPool().get_pool(request.user).connection() as conn:
-        user_result = Result(result=execute(conn, user_query, topic))
-
-    solu_result = Result(result=[{"no_output": ""}])
-    correct = False
-    # Evaluate
-    if exercise.is_select:
-        solution = m.Solution.objects.filter(exercise=exercise).first()
-        with PgConnPool().get_pool(request.user).connection() as conn:
-            solu_result.result = execute(conn, solution.sql, topic)
-        correct = check_results(user_result, solu_result, exercise)
-    else:
-        with PgConnPool().get_pool(request.user).connection() as conn:
-            correct = execute_check(conn, exercise.eval_statement, topic)
+    # identical checks in flight, e.g. after a double click, share one run
+    user_result, solu_result, correct = checks.run(
+        (request.user.pk, exercise.pk, user_query),
+        lambda: check_answer(request.user, topic, exercise, user_query),
+    )
     message = check_mand_deny_list(user_query, exercise)
     correct = False if message else correct
 
@@ -88,51 +97,90 @@ def check_answer_correct_api(request: HttpRequest, data: QueryIn):
     )
 
 
+def check_answer(
+    user: LTIUser, topic: m.Topic, exercise: m.Exercise, user_query: str
+) -> Tuple[Result, Result, bool]:
+    """Resets the user's schema and evaluates the query on one connection"""
+    rollback = settings.PG_STUD_CHECK_MODE == "rollback"
+    with PgConnPool().connection(user) as conn:
+        # Reset DB, skipped if the schema is unchanged since the last reset
+        do_reset_db(conn, topic, exercise)
+        if not rollback:
+            return evaluate(conn, user_query, topic, exercise)
+        with conn.transaction(force_rollback=True):
+            if exercise.is_select:
+                conn.execute("SET TRANSACTION READ ONLY;")
+            return evaluate(conn, user_query, topic, exercise, savepoint=True)
+
+
 @router.post("solution_result/", response=QueryOut)
+@admit("query")
+@offload
 def solution_result(request: HttpRequest, data: ExerciseSpeciIn):
     """Returns the output of the Solution number 1 after reseting the DB"""
-    topic = get_object_or_404(m.Topic, short=data.topic_short)
-    exercise = get_object_or_404(m.Exercise, topic=topic, enumber=data.enumber)
-    solution = m.Solution.objects.filter(exercise=exercise).first()
+    topic = get_catalog().topic(data.topic_short)
+    exercise = get_catalog().exercise(topic.short, data.enumber)
 
-    with PgConnPool().get_pool(request.user).connection() as conn:
+    solution_result = Rows([{"no_output": ""}])
+    with PgConnPool().connection(request.user) as conn:
         do_reset_db(conn, topic, exercise)
+        if exercise.is_select:
+            solution_result = get_solution_result(conn, topic, exercise)
+
+    return QueryOut(
+        result=Result(result=solution_result, truncated=solution_result.truncated)
+    )
+
+
+@router.get("ready/", auth=None, response={200: Message, 503: Message})
+def ready(request: HttpRequest):
+    """Readiness for the load balancer, 503 while the circuit breakers of all
+    student database hosts are open or the broker does not answer"""
+    try:
+        available = is_available(request)
+    except PoolTimeout:
+        available = False
+    if not available:
+        return 503, Message(message="Student database unavailable")
+    return Message(message="Ready")
 
-    if exercise.is_select:
-        with PgConnPool().get_pool(request.user).connection() as conn:
-            solution_result = execute(conn, solution.sql, topic)
-    else:
-        solution_result = [{"no_output": ""}]
 
-    return QueryOut(result=Result(result=solution_result))
+@brokered
+def is_available(request: HttpRequest) -> bool:
+    """Checks the circuit breakers of the pools, in the broker if there is one"""
+    return PgConnPool().is_available()
+
+
+@brokered
+def warm_up_student(request: HttpRequest) -> None:
+    """Warms up the pools of the student, in the broker if there is one"""
+    warm_up(request.user)
 
 
 @router.post("check_or_install_db/", response=Message)
+@admit("check")
+@offload
 def check_or_install_db(request: HttpRequest, data: ExerciseSpeciIn):
     """If the schema for the topic is not installed the db will be installed.
     enumber is being ignored"""
-    topic = get_object_or_404(m.Topic, short=data.topic_short)
+    topic = get_catalog().topic(data.topic_short)
 
-    with PgConnPool().get_pool(request.user).connection() as conn:
-        conn.autocommit = False  # let script decide when to commit
-
-        if is_installed(conn, topic):
+    with PgConnPool().connection(request.user) as conn:
+        if not ensure_installed(conn, topic):
             return Message(message="Already Installed!")
 
-        with conn.cursor() as cursor:
-            install_db(cursor, topic)
-            conn.commit()
-
     return Message(message="Installed Successfully!")
 
 
 @router.post("reset_db/", response=Message)
+@admit("check")
+@offload
 def reset_db(request: HttpRequest, data: ExerciseSpeciIn):
     """Resets DB to specific exercise"""
-    topic = get_object_or_404(m.Topic, short=data.topic_short)
-    exercise = get_object_or_404(m.Exercise, topic=topic, enumber=data.enumber)
+    topic = get_catalog().topic(data.topic_short)
+    exercise = get_catalog().exercise(topic.short, data.enumber)
 
-    with PgConnPool().get_pool(request.user).connection() as conn:
+    with PgConnPool().connection(request.user) as conn:
         do_reset_db(conn, topic, exercise)
 
     return Message(message="Reseted Successfully!")
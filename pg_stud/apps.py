@@ -8,3 +8,6 @@ from django.apps import AppConfig
 class PgStudConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pg_stud"
+
+    def ready(self):
+        from pg_stud import signals  # noqa: F401
@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module provides a circuit breaker for the student database host.
+
+After PG_STUD_BREAKER_FAILURES failed attempts in a row to get a connection,
+the breaker opens and requests fail at once with a PoolTimeout instead of
+waiting for the timeout of the pool. A timeout of the pool only counts as a
+failure if the host does not answer a ping, else the pool was just busy. A
+thread pings the host every PG_STUD_BREAKER_PROBE seconds and closes the
+breaker when the host answers.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+from django.conf import settings
+from psycopg import OperationalError, pq
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import PoolTimeout
+
+# seconds to wait for the answer to a ping
+PING_TIMEOUT = 2
+
+
+class CircuitBreaker:
+    """Circuit breaker around getting connections from the pools"""
+
+    def __init__(self, conninfo: Callable[[], Dict[str, Any]]):
+        """
+        Args:
+            conninfo: Returns the conninfo of the host to ping
+        """
+        self._conninfo = conninfo
+        self._lock = threading.Lock()
+        self._failures = 0
+        self.is_open = False
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """Counts the failures to get a connection in the block"""
+        try:
+            yield
+        except PoolTimeout:
+            if not self.answers():
+                self._failed()
+            raise
+        except OperationalError:
+            self._failed()
+            raise
+        with self._lock:
+            self._failures = 0
+
+    def _failed(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if (
+                self.is_open
+                or not settings.PG_STUD_BREAKER_FAILURES
+                or self._failures < settings.PG_STUD_BREAKER_FAILURES
+            ):
+                return
+            self.is_open = True
+        logging.warning("student database unavailable, opening circuit breaker")
+        threading.Thread(target=self._probe, daemon=True).start()
+
+    def answers(self) -> bool:
+        """Pings the host"""
+        conninfo = make_conninfo(**self._conninfo(), connect_timeout=PING_TIMEOUT)
+        return pq.PGconn.ping(conninfo.encode()) == pq.Ping.OK
+
+    def _probe(self) -> None:
+        """Pings the host until it answers and closes the breaker"""
+        while True:
+            time.sleep(settings.PG_STUD_BREAKER_PROBE)
+            if self.answers():
+                break
+        with self._lock:
+            self._failures = 0
+            self.is_open = False
+        logging.warning("student database available, closing circuit breaker")
@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module lets one broker process run the pg_stud views of all workers.
+
+With PG_STUD_BROKER set to the path of a Unix socket, the offloaded views send
+their name, the user and their arguments to the broker started with
+`manage.py runbroker`, which runs them with its PgConnPool. The connections of
+a student then do not depend on the number of workers. A worker waits
+PG_STUD_BROKER_TIMEOUT seconds for the answer, then it drops its connection
+and the broker drops the late answer.
+"""
+import logging
+import pickle
+import threading
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from typing import Any, Callable, Dict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
+from psycopg_pool import PoolTimeout
+
+from ltiapi.models import LTIUser
+
+# name: offloaded view, filled by offload
+views: Dict[str, Callable[..., Any]] = {}
+
+# connection of each worker thread to the broker
+_local = threading.local()
+
+
+def view_name(view: Callable[..., Any]) -> str:
+    return f"{view.__module__}.{view.__qualname__}"
+
+
+def authkey() -> bytes:
+    return settings.SECRET_KEY.encode()
+
+
+def remote(view: Callable[..., Any]) -> Callable[..., Any]:
+    """Returns a function which runs the view in the broker"""
+    name = view_name(view)
+
+    def call(request: HttpRequest, **kwargs):
+        message = (name, request.user.pk, kwargs)
+        try:
+            client = getattr(_local, "client", None)
+            if not client:
+                client = _local.client = Client(
+                    settings.PG_STUD_BROKER, family="AF_UNIX", authkey=authkey()
+                )
+            client.send(message)
+            if not client.poll(settings.PG_STUD_BROKER_TIMEOUT):
+                drop_client()
+                raise PoolTimeout("the pg_stud broker did not answer in time")
+            ok, result = client.recv()
+        except (OSError, EOFError) as e:
+            drop_client()
+            raise PoolTimeout("the pg_stud broker is unavailable") from e
+        if not ok:
+            raise result
+        return result
+
+    return call
+
+
+def drop_client() -> None:
+    """Closes the connection of the thread to the broker, a later answer
+    would be taken for the answer of the next request"""
+    client = getattr(_local, "client", None)
+    _local.client = None
+    if client:
+        client.close()
+
+
+def serve(listener: Listener) -> None:
+    """Accepts workers until the listener is closed"""
+    while True:
+        try:
+            conn = listener.accept()
+        except AuthenticationError:
+            logging.warning("pg_stud broker: connection with a wrong key")
+            continue
+        except OSError:
+            return
+        threading.Thread(
+            target=handle, args=(conn,), name="pg_stud_broker", daemon=True
+        ).start()
+
+
+def handle(conn) -> None:
+    """Runs the views requested by a worker thread one after another"""
+    with conn:
+        while True:
+            try:
+                name, user_pk, kwargs = conn.recv()
+            except (OSError, EOFError):
+                return
+            request = HttpRequest()
+            request.user = SimpleLazyObject(
+                lambda pk=user_pk: LTIUser.objects.get(pk=pk)
+            )
+            # like Django does at the start and end of requests
+            close_old_connections()
+            try:
+                answer = (True, views[name](request, **kwargs))
+            except Exception as e:
+                answer = (False, portable(e))
+            finally:
+                close_old_connections()
+            try:
+                conn.send(answer)
+            except OSError:
+                return  # the worker stopped waiting
+
+
+def portable(e: Exception) -> Exception:
+    """Returns the exception, or a plain copy if it cannot be sent back"""
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return Exception(str(e))
@@ -0,0 +1,256 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module loads the data of the datamodel scripts with COPY.
+
+A script is compiled when its topic is saved or by `manage.py compilescripts`,
+never in a request of a student. It runs on a fresh connection of the service
+role, see service, in a schema of PG_STUD_SERVICE_DB which is rolled back
+afterwards. Its statements run one by one and every INSERT as
+COPY (INSERT ... RETURNING ...) TO STDOUT, which captures the rows as the
+server converted them. The resulting plan of SQL and COPY FROM STDIN steps is
+stored per script digest. Installs send the DDL as before and the rows of
+consecutive INSERTs into a table in one COPY, scripts without a plan are
+executed as they are.
+
+The text of the copied rows depends on the session, whose settings a student
+may have changed on a pooled connection. While rows are copied the settings
+changing their text are pinned and the input settings reset to their
+defaults.
+
+Scripts controlling transactions or creating triggers or rules are not
+compiled, as COPY would behave differently for them.
+"""
+import logging
+import pickle
+import re
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple, Union
+
+import sqlparse
+from django.conf import settings
+from psycopg import DatabaseError, Rollback, sql
+from psycopg.cursor import Cursor
+
+from exercises import models as m
+from pg_stud import service
+from pg_stud.models import CompiledScript
+from pg_stud.pg_conn_pool import PgConnPool
+from pg_stud.scripts import Script, get_script
+
+# SQL to execute or (COPY FROM STDIN statement, rows)
+Step = Union[str, Tuple[str, bytearray]]
+# while compiling copies also keep their INSERT statements
+Compiled = Union[str, Tuple[str, bytearray, List[str]]]
+
+INSERT = re.compile(
+    r"INSERT\s+INTO\s+"
+    r'((?:"[^"]+"|[\w$]+)(?:\.(?:"[^"]+"|[\w$]+))?)\s*'  # table
+    r"(?:\(([^()]*)\))?\s*"  # columns
+    r"((?:VALUES|SELECT)\b.*?);?$",
+    re.IGNORECASE | re.DOTALL,
+)
+UNSUPPORTED = re.compile(
+    r"^(BEGIN|START|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE|COPY)\b"
+    r"|^CREATE\b[^;]*?\b(TRIGGER|RULE)\b",
+    re.IGNORECASE,
+)
+# fewer rows are sent as INSERTs with the other statements, which is faster
+# than a COPY of its own
+MIN_ROWS = 50
+
+# settings changing the text of values. DateStyle ISO only sets the output
+# format, the order of day and month in the input is reset to its default.
+# TimeZone is reset for input without a time zone, the output has one.
+PINNED = {
+    "DateStyle": ("DEFAULT", "ISO"),
+    "IntervalStyle": ("iso_8601",),
+    "extra_float_digits": ("3",),
+    "TimeZone": ("DEFAULT",),
+    "bytea_output": ("hex",),
+    "lc_monetary": ("C",),
+    "xmloption": ("content",),
+    "client_encoding": ("UTF8",),
+}
+# prefix of the schemas the scripts are compiled in
+SCHEMA_PREFIX = "_compile_"
+
+SEQUENCES = """
+SELECT sequencename, last_value FROM pg_sequences
+ WHERE schemaname = current_schema() AND last_value IS NOT NULL;"""
+
+
+def load_script(cursor: Cursor, topic: m.Topic) -> None:
+    """Executes the datamodel script of the topic in the current schema, with
+    its plan if it was compiled"""
+    script = get_script(topic)
+    if has_plan(topic, script) and script.plan is not None:
+        try:
+            with cursor.connection.transaction():
+                run_plan(cursor, script.plan)
+            return
+        except DatabaseError:
+            # the plan is kept, the session may have made it fail
+            logging.exception("compiled script of %s failed", topic.short)
+    cursor.execute(script.text)
+
+
+def compile_topic(topic: m.Topic) -> None:
+    """Compiles the datamodel script of the topic on a fresh connection of the
+    service role and stores the plan"""
+    script = get_script(topic)
+    host = next(
+        host for host in PgConnPool().hosts() if host not in settings.PG_STUD_DRAIN
+    )
+    with service.connect(host, settings.PG_STUD_SERVICE_DB) as conn:
+        with conn.transaction(force_rollback=True), conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL(
+                    "CREATE SCHEMA {0}; SET LOCAL search_path TO {0}, pg_temp;"
+                ).format(sql.Identifier(SCHEMA_PREFIX + topic.short))
+            )
+            plan = compile_script(cursor, script)
+    store_plan(topic, script, plan)
+
+
+def has_plan(topic: m.Topic, script: Script) -> bool:
+    """Checks if the script was compiled, the plan is None if it can't be"""
+    if not script.compiled:
+        stored = CompiledScript.objects.filter(
+            topic=topic, digest=script.digest
+        ).first()
+        if stored is not None:
+            script.plan = pickle.loads(stored.plan)
+            script.compiled = True
+    return script.compiled
+
+
+def store_plan(topic: m.Topic, script: Script, plan: Optional[List[Step]]) -> None:
+    script.plan = plan
+    script.compiled = True
+    CompiledScript.objects.update_or_create(
+        topic=topic, defaults={"digest": script.digest, "plan": pickle.dumps(plan)}
+    )
+
+
+def compile_script(cursor: Cursor, script: Script) -> Optional[List[Step]]:
+    """Executes the script and returns its plan. None if the script can't be
+    compiled or copying is not worth it, then nothing was executed.
+    Must not run in a session of a student, see compile_topic."""
+    statements = [
+        (s, sqlparse.format(s, strip_comments=True).strip()) for s in script.statements
+    ]
+    if any(UNSUPPORTED.search(bare) for _, bare in statements):
+        return None
+
+    steps: List[Compiled] = []
+    try:
+        with cursor.connection.transaction(), pinned(cursor):
+            for statement, bare in statements:
+                insert = INSERT.fullmatch(bare)
+                if not insert or re.search(r"\bRETURNING\b", bare, re.IGNORECASE):
+                    cursor.execute(statement)
+                    steps.append(statement)
+                    continue
+                table, columns, _ = insert.groups()
+                copy_to = (
+                    f"COPY ({bare.rstrip(';')} RETURNING {columns or '*'}) TO STDOUT"
+                )
+                with cursor.copy(copy_to) as copy:
+                    rows = b"".join(bytes(data) for data in copy)
+                target = f"{table} ({columns})" if columns else table
+                copy_from = f"COPY {target} FROM STDIN"
+                last = steps[-1] if steps else None
+                if isinstance(last, tuple) and last[0] == copy_from:
+                    last[1].extend(rows)
+                    last[2].append(statement)
+                else:
+                    steps.append((copy_from, bytearray(rows), [statement]))
+            plan = finish(steps)
+            if plan is None:
+                raise Rollback()
+            # values taken from sequences are copied, not taken again
+            cursor.execute(SEQUENCES)
+            for name, value in cursor.fetchall():
+                add_sql(
+                    plan,
+                    sql.SQL("SELECT setval({}, {});")
+                    .format(
+                        sql.Literal(sql.Identifier(name).as_string(cursor)),
+                        sql.Literal(value),
+                    )
+                    .as_string(cursor),
+                )
+    except DatabaseError:
+        logging.exception("compiling a datamodel script failed")
+        return None
+    return plan
+
+
+def finish(steps: List[Compiled]) -> Optional[List[Step]]:
+    """Returns the plan of the steps. Copies of few rows are replaced by their
+    INSERTs. None if no copy is left."""
+    plan: List[Step] = []
+    for step in steps:
+        if isinstance(step, str):
+            add_sql(plan, step)
+        elif step[1].count(b"\n") < MIN_ROWS:
+            for statement in step[2]:
+                add_sql(plan, statement)
+        else:
+            plan.append((step[0], step[1]))
+    if all(isinstance(step, str) for step in plan):
+        return None
+    return plan
+
+
+def add_sql(plan: List[Step], statement: str) -> None:
+    """Appends the statement, consecutive statements are sent at once"""
+    if plan and isinstance(plan[-1], str):
+        # the statement may end with a comment instead of a semicolon
+        plan[-1] += "\n;\n" + statement
+    else:
+        plan.append(statement)
+
+
+def run_plan(cursor: Cursor, plan: List[Step]) -> None:
+    with pinned(cursor):
+        for step in plan:
+            if isinstance(step, str):
+                cursor.execute(step)
+            else:
+                with cursor.copy(step[0]) as copy:
+                    copy.write(step[1])
+
+
+@contextmanager
+def pinned(cursor: Cursor) -> Iterator[None]:
+    """Pins the PINNED settings in the current transaction for the block and
+    restores them afterwards. A failed block aborts the transaction anyway."""
+    names = [sql.Literal(name) for name in PINNED]
+    cursor.execute(
+        sql.SQL("SELECT {};").format(
+            sql.SQL(", ").join(sql.SQL("current_setting({})").format(n) for n in names)
+        )
+    )
+    previous = cursor.fetchone()
+    cursor.execute(
+        sql.SQL(" ").join(
+            sql.SQL("SET LOCAL {} TO {};").format(
+                sql.Identifier(name),
+                sql.SQL(value) if value == "DEFAULT" else sql.Literal(value),
+            )
+            for name, values in PINNED.items()
+            for value in values
+        )
+    )
+    yield
+    cursor.execute(
+        sql.SQL("SELECT {};").format(
+            sql.SQL(", ").join(
+                sql.SQL("set_config({}, %s, true)").format(n) for n in names
+            )
+        ),
+        previous,
+    )
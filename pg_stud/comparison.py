@@ -0,0 +1,44 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module compares query results as multisets of rows.
+
+Rows are turned into hashable keys and counted, so comparing two results
+takes linear time. Every row can match only one row of the other result,
+so duplicates are counted correctly.
+"""
+from collections import Counter
+from typing import Any, Dict, Hashable, List
+
+
+def freeze(value: Any) -> Hashable:
+    """Returns a hashable value equal to value, e.g. for arrays and json"""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def row_key(row: Dict[str, Any]) -> Hashable:
+    """Returns a hashable key of the row, independent of the column order"""
+    # column names are unique, so the values are never compared when sorting
+    return tuple(sorted((col, freeze(v)) for col, v in row.items()))
+
+
+def missing_rows(rows: List[Dict[str, Any]], other: List[Dict[str, Any]]) -> List[int]:
+    """Returns the indices of the rows which are not in other.
+    If a row is n times more often in rows than in other, its last n
+    occurrences are missing.
+    """
+    available = Counter(map(row_key, other))
+    missing = []
+    for i, key in enumerate(map(row_key, rows)):
+        if available[key] > 0:
+            available[key] -= 1
+        else:
+            missing.append(i)
+    return missing
@@ -0,0 +1,206 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module compares the user query and the solution in the database.
+
+Both queries are used as subqueries of EXCEPT ALL in both directions, so
+only a bounded sample of each result and of the differing rows is fetched.
+With check_order the rows are compared by position instead. Numbering them in
+the database would not keep the order of the query, so both results are read
+in batches from cursors, until the first difference after the sample.
+
+Types without equality like json, xml or point cannot be compared with
+EXCEPT ALL, the results are compared in python then, see evaluate.
+"""
+from collections import Counter
+from contextlib import suppress
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlparse
+from django.conf import settings
+from psycopg import DatabaseError, Error, sql
+from psycopg.connection import Connection
+from psycopg.errors import UndefinedFunction
+
+from exercises import models as m
+from exercises.catalog import get_catalog
+from pg_stud.comparison import row_key
+from pg_stud.resources import TIMEOUTS, set_resources
+from pg_stud.schemas import Result
+from pg_stud.utils import dict_row, set_search_path
+
+SAMPLE = "SELECT * FROM ({query}) AS q LIMIT {limit}"
+SIDE = "SELECT {columns} FROM ({query}) AS q"
+DIFFERENCE = "SELECT * FROM (({rows}) EXCEPT ALL ({other})) AS d LIMIT {limit}"
+DECLARE = "DECLARE {} NO SCROLL CURSOR FOR {}"
+FETCH = "FETCH {} FROM {}"
+# rows fetched at once from the cursors of ordered results
+BATCH = 1000
+
+
+def is_comparable(query: str) -> bool:
+    """Checks if the query is a single SELECT which can be used as subquery"""
+    statements = sqlparse.parse(query)
+    return len(statements) == 1 and statements[0].get_type() == "SELECT"
+
+
+def subquery(query: str) -> sql.SQL:
+    """Returns the query without comments and trailing semicolon"""
+    return sql.SQL(sqlparse.format(query, strip_comments=True).strip().rstrip(";"))
+
+
+def compare_in_database(
+    conn: Connection,
+    user_query: str,
+    topic: m.Topic,
+    exercise: m.Exercise,
+    savepoint=False,
+) -> Optional[Tuple[Result, Result, bool]]:
+    """Compares the user query with the first solution in the database.
+    The queries run in a transaction which is rolled back, or in a savepoint
+    which is rolled back if savepoint is set. The user query needs to be
+    comparable.
+
+    Returns:
+        samples of the user and solution result with the differing rows of
+        the samples marked and correctness. None if the rows have types
+        without equality.
+    """
+    solution = get_catalog().first_solution(exercise)
+    user, solu = subquery(user_query), subquery(solution.sql)
+    limit = sql.Literal(settings.PG_STUD_COMPARE_SAMPLE)
+
+    user_result = Result(result=[{"no_output": ""}])
+    solu_result = Result(result=[{"no_output": ""}])
+    sampled = False
+    with conn.cursor() as setup, conn.cursor(
+        row_factory=dict_row
+    ) as solu_cursor, conn.cursor(row_factory=dict_row) as user_cursor:
+        try:
+            with conn.pipeline(), conn.transaction(force_rollback=True):
+                set_search_path(setup, topic)
+                set_resources(setup, topic, exercise)
+                solu_cursor.execute(sql.SQL(SAMPLE).format(query=solu, limit=limit))
+                user_cursor.execute(sql.SQL(SAMPLE).format(query=user, limit=limit))
+                solu_result.result = sample(solu_cursor)
+                user_result.result = sample(user_cursor)
+                sampled = True
+
+                columns = column_names(solu_cursor, user_cursor)
+                if columns is None:
+                    user_result.miss_cols = list(
+                        user_result.result[0].keys() - solu_result.result[0].keys()
+                    )
+                    solu_result.miss_cols = list(
+                        solu_result.result[0].keys() - user_result.result[0].keys()
+                    )
+                    return user_result, solu_result, False
+
+                if exercise.check_order:
+                    missing, extra, equal = ordered_difference(
+                        setup, solu_cursor, user_cursor, solu, user
+                    )
+                    solu_result.miss_rows, user_result.miss_rows = missing, extra
+                    return user_result, solu_result, equal
+
+                sides = [side(query, columns) for query in (solu, user)]
+                missing = difference(solu_cursor, sides[0], sides[1], limit)
+                extra = difference(user_cursor, sides[1], sides[0], limit)
+                mark(solu_result, missing)
+                mark(user_result, extra)
+                return user_result, solu_result, not (missing or extra)
+        except DatabaseError as e:
+            if sampled and isinstance(e, UndefinedFunction):
+                return None  # no equality operator
+            if not sampled:
+                # the results before the failed query are still available
+                error = "query_timeout" if isinstance(e, TIMEOUTS) else "error_in_query"
+                user_result.result = [{error: e.args}]
+                with suppress(Error):
+                    solu_result.result = sample(solu_cursor)
+            return user_result, solu_result, False
+
+
+def sample(cursor) -> List[Dict[str, Any]]:
+    """Fetches the sample like execute does"""
+    result = cursor.fetchall()
+    if result == []:
+        return [{col.name: "" for col in cursor.description}]
+    return result
+
+
+def column_names(solution_cursor, user_cursor) -> Optional[sql.Composable]:
+    """Returns the columns of the solution to select from both queries.
+    If the user query has other columns None is returned. If the columns are
+    not unique they are selected by position.
+    """
+    solution = [col.name for col in solution_cursor.description]
+    user = [col.name for col in user_cursor.description]
+    if Counter(solution) != Counter(user):
+        return None
+    if len(set(solution)) < len(solution):
+        return sql.SQL("*")
+    return sql.SQL(", ").join(map(sql.Identifier, solution))
+
+
+def side(query: sql.SQL, columns: sql.Composable) -> sql.Composed:
+    """Returns the query with the columns in the order of the solution"""
+    return sql.SQL(SIDE).format(columns=columns, query=query)
+
+
+def difference(
+    cursor, rows: sql.Composed, other: sql.Composed, limit: sql.Literal
+) -> List[Dict[str, Any]]:
+    """Returns a sample of the rows which are not in other"""
+    cursor.execute(sql.SQL(DIFFERENCE).format(rows=rows, other=other, limit=limit))
+    return cursor.fetchall()
+
+
+def ordered_difference(
+    setup, solu_cursor, user_cursor, solu: sql.SQL, user: sql.SQL
+) -> Tuple[List[int], List[int], bool]:
+    """Compares the results row by row in the order of the queries.
+
+    Returns:
+        the positions in the samples of the solution rows which are missing
+        and of the user rows which are extra, and if the results are equal
+    """
+    names = [sql.Identifier("_solution"), sql.Identifier("_user")]
+    for name, query in zip(names, (solu, user)):
+        setup.execute(sql.SQL(DECLARE).format(name, query))
+
+    size = settings.PG_STUD_COMPARE_SAMPLE
+    missing: List[int] = []
+    extra: List[int] = []
+    position = 0
+    while True:
+        batches = []
+        for cursor, name in zip((solu_cursor, user_cursor), names):
+            cursor.execute(sql.SQL(FETCH).format(sql.Literal(BATCH), name))
+            batches.append(cursor.fetchall())
+        solu_rows, user_rows = batches
+        for i in range(max(len(solu_rows), len(user_rows))):
+            solu_row = row_key(solu_rows[i]) if i < len(solu_rows) else None
+            user_row = row_key(user_rows[i]) if i < len(user_rows) else None
+            if solu_row == user_row:
+                continue
+            if position + i >= size:
+                # only rows of the samples are marked
+                return missing, extra, False
+            if solu_row is not None:
+                missing.append(position + i)
+            if user_row is not None:
+                extra.append(position + i)
+        if len(solu_rows) < BATCH and len(user_rows) < BATCH:
+            return missing, extra, not (missing or extra)
+        position += BATCH
+
+
+def mark(result: Result, differing: List[Dict[str, Any]]) -> None:
+    """Marks the rows of the sample which are in the sample of differing rows"""
+    available = Counter(map(row_key, differing))
+    for i, key in enumerate(map(row_key, result.result)):
+        if available[key] > 0:
+            available[key] -= 1
+            result.miss_rows.append(i)
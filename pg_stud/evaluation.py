@@ -4,14 +4,20 @@
 
 """This module is for evaluation of user queries and results"""
 from functools import reduce
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from ninja import Schema
+from psycopg.connection import Connection
 
 from exercises import models as m
 from ltiapi.models import LTIUser
+from pg_stud.comparison import missing_rows
+from pg_stud.db_comparison import compare_in_database, is_comparable
 from pg_stud.schemas import Result
+from pg_stud.solution_cache import get_solution_result
+from pg_stud.utils import execute, execute_check
 
 
 def check_mand_deny_list(user_query: str, exercise: m.Exercise) -> str:
@@ -40,23 +46,16 @@ def check_mand_deny_list(user_query: str, exercise: m.Exercise) -> str:
 
 
 def check_results(user: Result, solution: Result, exercise: m.Exercise) -> bool:
+    """Compares the results as multisets of rows and marks missing columns and
+    rows on each. With check_order the rows must be in the same order as well.
+    """
     # mark column names not the same on each
     user.miss_cols = list(user.result[0].keys() - solution.result[0].keys())
     solution.miss_cols = list(solution.result[0].keys() - user.result[0].keys())
 
-    # If the user table does differ too much from the solution it is not
-    #  being parsed
-    if abs(len(user.result) - len(solution.result)) > 30:
-        return False
-
-    # Go through rows of user and solution and mark the other if not present
-    for i, row in enumerate(solution.result):
-        if row not in user.result:
-            solution.miss_rows.append(i)
-    for i, row in enumerate(user.result):
-        if row not in solution.result:
-            if i not in user.miss_rows:
-                user.miss_rows.append(i)
+    # mark rows of each which are not present in the other
+    solution.miss_rows = missing_rows(solution.result, user.result)
+    user.miss_rows = missing_rows(user.result, solution.result)
 
     # shortcut without equal
     if (
@@ -71,3 +70,51 @@ def check_results(user: Result, solution: Result, exercise: m.Exercise) -> bool:
         return True
 
     return user.result == solution.result
+
+
+def evaluate(
+    conn: Connection,
+    user_query: str,
+    topic: m.Topic,
+    exercise: m.Exercise,
+    savepoint=False,
+) -> Tuple[Result, Result, bool]:
+    """Executes the user query and compares it to the first solution or checks
+    it with the eval_statement of the exercise.
+
+    Args:
+        savepoint: run the queries in savepoints of the current transaction
+          instead of committing them
+
+    Returns:
+        user result, solution result and correctness
+    """
+    comparable = exercise.is_select and is_comparable(user_query)
+    if settings.PG_STUD_COMPARE_MODE == "database" and comparable:
+        compared = compare_in_database(conn, user_query, topic, exercise, savepoint)
+        # None for types without equality, which are compared in python
+        if compared is not None:
+            return compared
+
+    # The solution result is cached, on a miss it is computed apart from the
+    # student's schema, see solution_cache.
+    solu_result = Result(result=[{"no_output": ""}])
+    if exercise.is_select:
+        solution = get_solution_result(conn, topic, exercise)
+        # truncated results can only be compared in the database
+        if solution.truncated and comparable:
+            compared = compare_in_database(conn, user_query, topic, exercise, savepoint)
+            if compared is not None:
+                return compared
+        solu_result = Result(result=solution, truncated=solution.truncated)
+
+    user = execute(conn, user_query, topic, savepoint, exercise)
+    user_result = Result(result=user, truncated=user.truncated)
+
+    if exercise.is_select:
+        correct = check_results(user_result, solu_result, exercise) and not (
+            user_result.truncated or solu_result.truncated
+        )
+    else:
+        correct = execute_check(conn, exercise.eval_statement, topic, exercise)
+    return user_result, solu_result, correct
@@ -0,0 +1,20 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import djclick as click
+
+from exercises import models as m
+from pg_stud.bulk_load import compile_topic, has_plan
+from pg_stud.scripts import get_script
+
+
+@click.command()
+@click.option("--force", is_flag=True, help="compile scripts with a plan again")
+def command(force: bool):
+    """Compiles the datamodel scripts of the topics, e.g. after the files were
+    changed without saving the topics"""
+    for topic in m.Topic.objects.all():
+        if force or not has_plan(topic, get_script(topic)):
+            compile_topic(topic)
+            print(f"Compiled the script of {topic.short}")
@@ -0,0 +1,27 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+from multiprocessing.connection import Listener
+
+import djclick as click
+from django.conf import settings
+
+# registers the offloaded views
+import pg_stud.api  # noqa: F401
+from pg_stud.broker import authkey, serve
+
+
+@click.command()
+def command():
+    """Runs the pg_stud views of all workers on the socket PG_STUD_BROKER"""
+    if not settings.PG_STUD_BROKER:
+        raise click.ClickException("PG_STUD_BROKER is not set")
+    if os.path.exists(settings.PG_STUD_BROKER):
+        os.unlink(settings.PG_STUD_BROKER)
+    with Listener(
+        settings.PG_STUD_BROKER, family="AF_UNIX", authkey=authkey()
+    ) as listener:
+        print(f"Broker listening on {settings.PG_STUD_BROKER}")
+        serve(listener)
@@ -0,0 +1,50 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module is for counters of pg_stud operations.
+The counters are kept in the cache to be shared by all workers."""
+from typing import Dict, Tuple
+
+from django.core.cache import cache
+
+PREFIX = "pg_stud:metrics:"
+
+COUNTERS = [
+    "reset_total",
+    "reset_skipped",
+    "solution_total",
+    "solution_cached",
+]
+
+# rate name: (numerator, denominator)
+RATES: Dict[str, Tuple[str, str]] = {
+    "reset_skip_rate": ("reset_skipped", "reset_total"),
+    "solution_hit_rate": ("solution_cached", "solution_total"),
+}
+
+
+def incr(name: str, delta: int = 1) -> None:
+    """Increments the counter by delta"""
+    key = PREFIX + name
+    if cache.add(key, delta, timeout=None):
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # evicted since add
+        cache.add(key, delta, timeout=None)
+
+
+def counters() -> Dict[str, int]:
+    """Returns all counters"""
+    values = cache.get_many([PREFIX + name for name in COUNTERS])
+    return {name: values.get(PREFIX + name, 0) for name in COUNTERS}
+
+
+def rates(values: Dict[str, int]) -> Dict[str, float]:
+    """Returns the rates of the counters. 0 if the denominator is 0."""
+    return {
+        name: values[num] / values[den] if values[den] else 0.0
+        for name, (num, den) in RATES.items()
+    }
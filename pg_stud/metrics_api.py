@@ -0,0 +1,24 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.http import HttpRequest
+from ninja import Router
+
+from ltiapi import utils
+from pg_stud import metrics
+from pg_stud.schemas import Metrics
+
+router = Router(
+    # Restrict usage to superuser and instructors
+    auth=lambda request: utils.is_superior(request.user),
+)
+
+
+@router.get("/", response=Metrics)
+def get_metrics(request: HttpRequest):
+    """Returns the counters of pg_stud operations of all workers
+    :returns:   - counters: e.g. reset_total, reset_skipped
+                - rates:    e.g. reset_skip_rate = reset_skipped / reset_total"""
+    counters = metrics.counters()
+    return Metrics(counters=counters, rates=metrics.rates(counters))
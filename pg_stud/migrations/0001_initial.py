@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("exercises", "0003_alter_topic_options_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SolutionResult",
+            fields=[
+                (
+                    "exercise",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="exercises.exercise",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64)),
+                ("result", models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exercises", "0005_resource_limits"),
+        ("pg_stud", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CompiledScript",
+            fields=[
+                (
+                    "topic",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="exercises.topic",
+                    ),
+                ),
+                ("digest", models.CharField(max_length=64)),
+                ("plan", models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exercises", "0005_resource_limits"),
+        ("pg_stud", "0002_compiledscript"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InstalledSchema",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=40, primary_key=True, serialize=False),
+                ),
+                (
+                    "topic",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="exercises.topic",
+                    ),
+                ),
+            ],
+        ),
+    ]
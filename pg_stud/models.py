@@ -4,4 +4,35 @@
 
 from django.db import models
 
-# Create your models here.
+from exercises.models import Exercise, Topic
+
+
+class SolutionResult(models.Model):
+    """Result of the first solution of a SELECT exercise.
+    It is only valid while key matches the key of the exercise's solution.
+    """
+
+    exercise = models.OneToOneField(
+        Exercise, on_delete=models.CASCADE, primary_key=True
+    )
+    key = models.CharField(max_length=64)
+    # pickled to keep the python types of the rows
+    result = models.BinaryField()
+
+
+class CompiledScript(models.Model):
+    """Steps loading the datamodel script of a topic with COPY.
+    It is only valid while digest matches the digest of the script.
+    """
+
+    topic = models.OneToOneField(Topic, on_delete=models.CASCADE, primary_key=True)
+    digest = models.CharField(max_length=64)
+    # pickled list of steps, None if the script can't be compiled
+    plan = models.BinaryField()
+
+
+class InstalledSchema(models.Model):
+    """Topic schema which is installed in a student database, see state"""
+
+    key = models.CharField(max_length=40, primary_key=True)
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module turns the blocking pg_stud views into async views.
+
+Under ASGI Django runs all sync views of a worker one after another in a
+single thread. The offloaded views run in a pool of PG_STUD_THREADS threads
+instead, so a worker keeps that many student queries in flight.
+
+Threads are used instead of async connections of psycopg, which would need
+the views, the pools, the checks and the broker written again as coroutines.
+A thread waiting for its query blocks in libpq and holds little memory: its
+stack is reserved (8 MB of virtual memory on Linux) but only the few pages
+touched are resident, so hundreds of threads cost a few MB.
+
+With PG_STUD_BROKER set the views run in the broker process, see broker. So
+do the warm-up and the readiness check, which need the pools of the broker.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest
+from ninja.security import SessionAuth
+
+from pg_stud import broker
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    """Returns the thread pool of the offloaded views"""
+    global _executor
+    with _executor_lock:
+        if not _executor:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PG_STUD_THREADS, thread_name_prefix="pg_stud"
+            )
+        return _executor
+
+
+def in_thread(function: Callable[..., Any], *args, **kwargs) -> Any:
+    """Calls the function in a thread of the pool"""
+    # like Django does at the start and end of requests
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def offload(view: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """Turns a blocking view into an async view which runs in the thread pool.
+    With PG_STUD_THREADS 0 it runs in the thread of the sync views instead.
+    With PG_STUD_BROKER set the thread only waits for the broker."""
+    broker.views[broker.view_name(view)] = view
+    in_broker = broker.remote(view)
+
+    @wraps(view)
+    async def async_view(*args, **kwargs):
+        function = in_broker if settings.PG_STUD_BROKER else view
+        if not settings.PG_STUD_THREADS:
+            return await sync_to_async(function)(*args, **kwargs)
+        return await sync_to_async(
+            in_thread, thread_sensitive=False, executor=executor()
+        )(function, *args, **kwargs)
+
+    return async_view
+
+
+def brokered(view: Callable[..., Any]) -> Callable[..., Any]:
+    """Lets a blocking view run in the broker if PG_STUD_BROKER is set, where
+    the pools are. It still blocks the calling thread."""
+    broker.views[broker.view_name(view)] = view
+    in_broker = broker.remote(view)
+
+    @wraps(view)
+    def call(*args, **kwargs):
+        return (in_broker if settings.PG_STUD_BROKER else view)(*args, **kwargs)
+
+    return call
+
+
+def submit(function: Callable[..., Any], *args) -> None:
+    """Calls the function in the background without waiting for it.
+    With PG_STUD_THREADS 0 it is called at once instead."""
+    if not settings.PG_STUD_THREADS:
+        function(*args)
+    else:
+        executor().submit(in_thread, function, *args)
+
+
+class AsyncSessionAuth(SessionAuth):
+    """Django session authentication for async views.
+    Loading the user from the session is blocking."""
+
+    async def __call__(self, request: HttpRequest) -> Optional[Any]:
+        return await sync_to_async(super().__call__)(request)
+
+
+async_django_auth = AsyncSessionAuth()
@@ -5,17 +5,24 @@
 """
 This module provides a singleton class for managing PostgreSQL connection pools
 """
+import heapq
+import itertools
 import logging
 import threading
 import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
 
-import psycopg
-from psycopg_pool import ConnectionPool
+from django.conf import settings
+from psycopg import Connection
+from psycopg_pool import ConnectionPool, PoolTimeout
 
 from ltiapi.models import LTIUser
-from sql_training import settings
+from pg_stud.breaker import CircuitBreaker
+from pg_stud.sharding import hash_ring, host_conninfo
+from pg_stud.tenancy import StudentConnection, configure
 
 # import psycopg_c
 
@@ -24,56 +31,279 @@ from sql_training import settings
 class PoolItem:
     pool: ConnectionPool
     last_access: float
+    leases: int = 0
 
 
 class PgConnPool:
     """
     Singleton class for managing PostgreSQL connection pools per user.
+
+    Each pool reserves PG_STUD_POOL_SIZE connections of the budget of
+    PG_STUD_MAX_CONNECTIONS. If the budget is used up the least recently used
+    idle pool is closed, else the request waits in a queue for a free pool.
+    Pools unused for PG_STUD_POOL_IDLE seconds are closed by a thread which
+    sleeps until the next pool in the expiry heap expires.
+
+    Students are spread over the hosts PG_STUD_HOSTS by consistent hashing.
+    Students of drained hosts and of hosts with an open circuit breaker fail at
+    once, as no other host has their database, role or schemas.
     """
 
     _instance = None  # typing when python 3.11 is on Debian
-    _user_pools: Dict[str, PoolItem] = {}
-    conninfo = lambda self, lms_username: (
-        settings.PG_STUD_CONNINFO | {"user": lms_username, "dbname": lms_username}
+    # username@host: pool, least recently used first
+    _user_pools: "OrderedDict[str, PoolItem]"
+    # (expiry time, sequence number, username@host, pool) of every open pool
+    _expiry: List[Tuple[float, int, str, PoolItem]]
+    # requests waiting for a part of the budget, first come first served
+    _waiting: Deque[object]
+    _reserved: int
+    # username@host of pools being created
+    _creating: Set[str]
+    _sequence: Iterator[int]
+    _changed: threading.Condition
+    # host: circuit breaker
+    _breakers: Dict[str, CircuitBreaker]
+    conninfo = lambda self, lms_username, host: (
+        settings.PG_STUD_CONNINFO
+        | host_conninfo(host)
+        | {
+            "user": lms_username,
+            "dbname": (
+                settings.PG_STUD_SHARED_DB
+                if settings.PG_STUD_TENANCY == "shared_database"
+                else lms_username
+            ),
+        }
+        if settings.DEPLOY
+        else settings.PG_TEST_CONNINFO
+    )
+    # pings need no user or database
+    ping_conninfo = lambda self, host: (
+        settings.PG_STUD_CONNINFO | host_conninfo(host)
         if settings.DEPLOY
         else settings.PG_TEST_CONNINFO
     )
+    hosts = lambda self: (
+        settings.PG_STUD_HOSTS
+        if settings.DEPLOY
+        else [
+            f"{settings.PG_TEST_CONNINFO['host']}:{settings.PG_TEST_CONNINFO['port']}"
+        ]
+    )
 
     def __new__(cls):
         """Get Singleton."""
         if not cls._instance:
             cls._instance = super().__new__(cls)
+            cls._instance._user_pools = OrderedDict()
+            cls._instance._expiry = []
+            cls._instance._waiting = deque()
+            cls._instance._reserved = 0
+            cls._instance._creating = set()
+            cls._instance._changed = threading.Condition()
+            cls._instance._sequence = itertools.count()
+            cls._instance._breakers = {}
 
-            # Create Thread that clears the pools every 20 minutes
-            def check(interval: int):
-                while True:
-                    time.sleep(interval)
-                    cls._instance.close_unused_pools(interval)  # type: ignore
-
-            threading.Thread(target=check, kwargs={"interval": 10}).start()
+            threading.Thread(
+                target=cls._instance.close_unused_pools, daemon=True
+            ).start()
         return cls._instance
 
-    def get_pool(self, user: LTIUser) -> ConnectionPool:
-        """Returns ConnectionPool for given user. Creates one if it does not exist"""
-        conninfo = self.conninfo(user.lms_username)
-        if user.lms_username not in self._user_pools:
-            new_pool = ConnectionPool(
-                min_size=1, max_size=3, timeout=5, kwargs=conninfo
-            )
+    @contextmanager
+    def connection(self, user: LTIUser) -> Iterator[Connection]:
+        """Yields a connection of the user's pool. Creates the pool if it does
+        not exist. The pool is not closed while the connection is in use.
+        Fails at once if no host is available.
+        """
+        host = self.route(user.lms_username)
+        item = self._checkout(user.lms_username, host)
+        try:
+            with self._borrow(item.pool, host) as conn:
+                yield conn
+        finally:
+            with self._changed:
+                item.leases -= 1
+                item.last_access = time.monotonic()
+                if not item.leases:
+                    self._changed.notify_all()
+
+    def route(self, lms_username: str) -> str:
+        """Returns the host of the student, the first host on the hash ring.
+        Fails if it is drained or unavailable."""
+        host = next(hash_ring(tuple(self.hosts())).hosts(lms_username))
+        if host in settings.PG_STUD_DRAIN or self.breaker(host).is_open:
+            raise PoolTimeout(f"the student database host {host} is not available")
+        return host
+
+    def is_available(self) -> bool:
+        """Checks if any host is neither drained nor unavailable"""
+        return any(
+            host not in settings.PG_STUD_DRAIN and not self.breaker(host).is_open
+            for host in self.hosts()
+        )
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        """Returns the circuit breaker of the host"""
+        with self._changed:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(lambda: self.ping_conninfo(host))
+            return self._breakers[host]
+
+    @contextmanager
+    def _borrow(self, pool: ConnectionPool, host: str) -> Iterator[Connection]:
+        """Like pool.connection(), failures to get a connection are counted by
+        the circuit breaker of the host"""
+        with self.breaker(host).guard():
+            conn = pool.getconn()
+        try:
+            with conn:
+                yield conn
+        finally:
+            pool.putconn(conn)
+
+    def _checkout(self, lms_username: str, host: str) -> PoolItem:
+        """Returns the leased pool of the user on the host. Creates it if it
+        does not exist, concurrent requests of the user wait for the creation.
+        """
+        key = f"{lms_username}@{host}"
+        with self._changed:
+            while key in self._creating:
+                self._changed.wait()
+            item = self._user_pools.get(key)
+            if item:
+                item.leases += 1
+                self._user_pools.move_to_end(key)
+                return item
+            self._creating.add(key)
+        try:
+            return self._create(key, lms_username, host)
+        finally:
+            with self._changed:
+                self._creating.discard(key)
+                self._changed.notify_all()
+
+    def _create(self, key: str, lms_username: str, host: str) -> PoolItem:
+        """Creates the leased pool of the user on the host in the budget"""
+        size = settings.PG_STUD_POOL_SIZE
+        with self._changed:
+            evicted = self._reserve(size)
+        self._close(evicted)
+
+        pool = ConnectionPool(
+            min_size=1,
+            max_size=size,
+            timeout=settings.PG_STUD_POOL_TIMEOUT,
+            connection_class=StudentConnection,
+            configure=configure(lms_username),
+            # no statements are prepared on the server, as a student can
+            # deallocate them without psycopg knowing, e.g. in a DO block
+            kwargs=self.conninfo(lms_username, host) | {"prepare_threshold": None},
+        )
+        try:
             # check initial pool health
-            with new_pool.connection():
+            with self.breaker(host).guard(), pool.connection():
                 pass
-            self._user_pools[user.lms_username] = PoolItem(new_pool, time.time())
-        else:
-            self._user_pools[user.lms_username].last_access = time.time()
-        return self._user_pools[user.lms_username].pool
-
-    def close_unused_pools(self, stale_time=1200):
-        """Closes pools open longer than stale_time.
-        If not called the pools would never be closed"""
-        logging.info("closing old pools")
-        keys = list(self._user_pools.keys())
-        for key in keys:
-            if self._user_pools[key].last_access < (time.time() - stale_time):
-                self._user_pools[key].pool.close()
-                self._user_pools.pop(key)
+        except BaseException:
+            pool.close()
+            with self._changed:
+                self._reserved -= size
+            raise
+
+        with self._changed:
+            item = PoolItem(pool, time.monotonic(), leases=1)
+            self._user_pools[key] = item
+            self._push_expiry(key, item)
+        return item
+
+    def _reserve(self, size: int) -> List[PoolItem]:
+        """Reserves size connections of the budget for a new pool. Waits in the
+        queue until the connections are available or PG_STUD_POOL_TIMEOUT is
+        over. Returns the evicted pools, which must be closed by the caller.
+        Must be called with _changed held.
+        """
+        deadline = time.monotonic() + settings.PG_STUD_POOL_TIMEOUT
+        ticket = object()
+        evicted: List[PoolItem] = []
+        self._waiting.append(ticket)
+        try:
+            while True:
+                if self._waiting[0] is ticket:
+                    if self._reserved + size <= settings.PG_STUD_MAX_CONNECTIONS:
+                        break
+                    victim = self._least_recently_used()
+                    if victim:
+                        evicted.append(self._remove(victim))
+                        continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout("no connections left in the budget")
+                self._changed.wait(remaining)
+            self._reserved += size
+        finally:
+            self._waiting.remove(ticket)
+            # the next request in the queue may be served now
+            self._changed.notify_all()
+        return evicted
+
+    def _least_recently_used(self) -> Optional[str]:
+        """Returns the key of the least recently used idle pool"""
+        return next(
+            (key for key, item in self._user_pools.items() if not item.leases),
+            None,
+        )
+
+    def _remove(self, key: str) -> PoolItem:
+        """Removes the pool from the registry and frees its connections"""
+        item = self._user_pools.pop(key)
+        self._reserved -= item.pool.max_size
+        return item
+
+    def _push_expiry(self, key: str, item: PoolItem):
+        heapq.heappush(
+            self._expiry,
+            (
+                item.last_access + settings.PG_STUD_POOL_IDLE,
+                next(self._sequence),
+                key,
+                item,
+            ),
+        )
+
+    def _expired(self) -> List[PoolItem]:
+        """Removes the expired pools. Pools used since their entry was pushed
+        are pushed again with their new expiry time.
+        """
+        expired = []
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, _, key, item = heapq.heappop(self._expiry)
+            if self._user_pools.get(key) is not item:
+                continue  # already evicted
+            if item.leases:
+                item.last_access = now
+            if item.last_access + settings.PG_STUD_POOL_IDLE > now:
+                self._push_expiry(key, item)
+            else:
+                expired.append(self._remove(key))
+        if expired:
+            self._changed.notify_all()
+        return expired
+
+    def _close(self, items: List[PoolItem]):
+        for item in items:
+            item.pool.close()
+
+    def close_unused_pools(self):
+        """Closes pools unused for PG_STUD_POOL_IDLE seconds.
+        If not running the pools would never be closed"""
+        while True:
+            with self._changed:
+                expired = self._expired()
+                while not expired:
+                    timeout = (
+                        self._expiry[0][0] - time.monotonic() if self._expiry else None
+                    )
+                    self._changed.wait(timeout)
+                    expired = self._expired()
+            logging.info("closing %d old pools", len(expired))
+            self._close(expired)
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module limits the resources of student queries.
+
+The settings of the exercise, its topic or the PG_STUD_* defaults are set
+locally in the transaction of each query, so a runaway query does not hold
+a connection of the pool for longer than its statement_timeout.
+"""
+from typing import Dict, Optional
+
+from django.conf import settings
+from psycopg import errors, sql
+from psycopg.cursor import Cursor
+
+from exercises import models as m
+
+# setting: default in the django settings
+DEFAULTS = {
+    "statement_timeout": "PG_STUD_STATEMENT_TIMEOUT",
+    "lock_timeout": "PG_STUD_LOCK_TIMEOUT",
+    "work_mem": "PG_STUD_WORK_MEM",
+    "temp_file_limit": "PG_STUD_TEMP_FILE_LIMIT",
+}
+
+# errors of queries which were too slow
+TIMEOUTS = (errors.QueryCanceled, errors.LockNotAvailable)
+
+
+def resource_settings(
+    topic: m.Topic, exercise: Optional[m.Exercise] = None
+) -> Dict[str, int]:
+    """Returns the settings of the exercise, its topic or the defaults.
+    Settings which are 0 are left to the server, except for timeouts."""
+    values = {}
+    for name, default in DEFAULTS.items():
+        candidates = (getattr(exercise, name, None), getattr(topic, name))
+        value = next(
+            (v for v in candidates if v is not None), getattr(settings, default)
+        )
+        if value or name.endswith("timeout"):
+            values[name] = value
+    return values
+
+
+def set_resources(
+    cursor: Cursor, topic: m.Topic, exercise: Optional[m.Exercise] = None
+) -> None:
+    """Sets the resource settings for the current transaction"""
+    values = resource_settings(topic, exercise)
+    cursor.execute(
+        sql.SQL("SELECT {};").format(
+            sql.SQL(", ").join(sql.SQL("set_config(%s, %s, true)") for _ in values)
+        ),
+        [param for name, value in values.items() for param in (name, str(value))],
+    )
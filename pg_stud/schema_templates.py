@@ -0,0 +1,440 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module is for resetting topic schemas by cloning snapshot schemas
+instead of replaying the datamodel script and past solutions of the topic.
+
+The template is the snapshot with the installed script. Every non-select
+exercise adds a snapshot with its solution applied. Snapshots are named after
+the topic and a digest of the script and the solutions they contain, so they
+are rebuilt when one of those changes. Each is built once per version and
+database. Resets copy its tables, sequences, constraints, indexes and views
+with a single batch of statements.
+
+The snapshots are built by the service role, see service, which owns them.
+Students can only read them, so a student can't change the state the other
+resets of the database start from.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from psycopg import DatabaseError, sql
+from psycopg.connection import Connection
+from psycopg.cursor import Cursor
+
+from exercises import models as m
+from exercises.catalog import get_catalog
+from pg_stud import service
+from pg_stud.bulk_load import load_script
+from pg_stud.scripts import get_script
+from pg_stud.tenancy import schema_name
+
+TEMPLATE_PREFIX = "_tpl_"
+
+# Clone script per (template, target). None if the template can't be cloned.
+# The template name contains the script digest, so entries never get stale.
+# The scripts of old versions are evicted as the least recently used.
+MAX_CLONE_SCRIPTS = 256
+_clone_scripts: "OrderedDict[str, Optional[str]]" = OrderedDict()
+_clone_scripts_lock = threading.Lock()
+
+# snapshots of earlier versions, which were built by the student's role
+STUDENT_SNAPSHOTS = """
+SELECT nspname FROM pg_namespace
+ WHERE starts_with(nspname, %(prefix)s)
+   AND nspowner = (SELECT oid FROM pg_roles WHERE rolname = current_user)
+   AND current_user <> %(service)s;"""
+
+UNSUPPORTED_OBJECTS = """
+SELECT (SELECT count(*) FROM pg_class
+         WHERE relnamespace = n.oid AND relkind NOT IN ('r', 'S', 'v', 'i'))
+     + (SELECT count(*) FROM pg_proc WHERE pronamespace = n.oid)
+     + (SELECT count(*) FROM pg_type
+         WHERE typnamespace = n.oid AND typtype IN ('d', 'e', 'r', 'm'))
+     + (SELECT count(*) FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid
+         WHERE c.relnamespace = n.oid AND NOT t.tgisinternal)
+     + (SELECT count(*) FROM pg_rewrite r JOIN pg_class c ON c.oid = r.ev_class
+         WHERE c.relnamespace = n.oid AND r.rulename <> '_RETURN')
+     + (SELECT count(*) FROM pg_policy p JOIN pg_class c ON c.oid = p.polrelid
+         WHERE c.relnamespace = n.oid)
+     + (SELECT count(*) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+         WHERE c.relnamespace = n.oid)
+     + (SELECT count(*) FROM pg_statistic_ext WHERE stxnamespace = n.oid)
+FROM pg_namespace n WHERE n.nspname = %(source)s;
+"""
+
+SEQUENCES = """
+SELECT format('CREATE SEQUENCE %%I AS %%s INCREMENT BY %%s MINVALUE %%s
+                MAXVALUE %%s START WITH %%s CACHE %%s %%s',
+              c.relname, format_type(s.seqtypid, NULL), s.seqincrement,
+              s.seqmin, s.seqmax, s.seqstart, s.seqcache,
+              CASE WHEN s.seqcycle THEN 'CYCLE' ELSE 'NO CYCLE' END),
+       format('SELECT setval(%%L, last_value, is_called) FROM %%I.%%I',
+              format('%%I', c.relname), n.nspname, c.relname)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_sequence s ON s.seqrelid = c.oid
+WHERE n.nspname = %(source)s
+  AND NOT EXISTS(SELECT 1 FROM pg_depend d
+                  WHERE d.objid = c.oid AND d.deptype = 'i')
+ORDER BY c.oid;
+"""
+
+TABLES = """
+SELECT format('CREATE %%sTABLE %%I (LIKE %%I.%%I INCLUDING COMMENTS
+                INCLUDING GENERATED INCLUDING IDENTITY INCLUDING STORAGE
+                INCLUDING COMPRESSION)',
+              CASE WHEN c.relpersistence = 'u' THEN 'UNLOGGED ' ELSE '' END,
+              c.relname, n.nspname, c.relname),
+       format('INSERT INTO %%I (%%s) OVERRIDING SYSTEM VALUE
+                SELECT %%2$s FROM %%I.%%I',
+              c.relname,
+              (SELECT string_agg(format('%%I', a.attname), ', ' ORDER BY a.attnum)
+                 FROM pg_attribute a
+                WHERE a.attrelid = c.oid AND a.attnum > 0
+                  AND NOT a.attisdropped AND a.attgenerated = ''),
+              n.nspname, c.relname)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = %(source)s AND c.relkind = 'r'
+ORDER BY c.oid;
+"""
+
+DEFAULTS = """
+SELECT format('ALTER TABLE %%I ALTER COLUMN %%I SET DEFAULT %%s',
+              c.relname, a.attname, pg_get_expr(d.adbin, d.adrelid))
+FROM pg_attrdef d
+JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+JOIN pg_class c ON c.oid = d.adrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = %(source)s AND c.relkind = 'r' AND a.attgenerated = ''
+ORDER BY c.oid, a.attnum;
+"""
+
+SEQUENCE_OWNERS = """
+SELECT CASE d.deptype
+        WHEN 'a' THEN format('ALTER SEQUENCE %%I OWNED BY %%I.%%I',
+                             s.relname, t.relname, a.attname)
+        ELSE format('SELECT setval(pg_get_serial_sequence(%%L, %%L),
+                       last_value, is_called) FROM %%I.%%I',
+                    format('%%I', t.relname), a.attname, n.nspname, s.relname)
+       END
+FROM pg_depend d
+JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+JOIN pg_class t ON t.oid = d.refobjid
+JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid
+JOIN pg_namespace n ON n.oid = s.relnamespace
+WHERE n.nspname = %(source)s AND d.classid = 'pg_class'::regclass
+  AND d.deptype IN ('a', 'i')
+ORDER BY s.oid;
+"""
+
+CONSTRAINTS = """
+SELECT format('ALTER TABLE %%I ADD CONSTRAINT %%I %%s',
+              c.relname, con.conname, pg_get_constraintdef(con.oid))
+FROM pg_constraint con
+JOIN pg_class c ON c.oid = con.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = %(source)s AND c.relkind = 'r'
+  AND con.contype IN ('c', 'p', 'u', 'x', 'f')
+ORDER BY con.contype = 'f', con.oid;
+"""
+
+INDEXES = """
+SELECT pg_get_indexdef(i.indexrelid)
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = %(source)s
+  AND NOT EXISTS(SELECT 1 FROM pg_constraint con
+                  WHERE con.conindid = i.indexrelid
+                    AND con.conrelid = i.indrelid
+                    AND con.contype IN ('p', 'u', 'x'))
+ORDER BY i.indexrelid;
+"""
+
+VIEWS = """
+SELECT format('CREATE VIEW %%I %%s AS %%s', c.relname,
+              CASE WHEN c.reloptions IS NULL THEN ''
+                   ELSE format('WITH (%%s)', array_to_string(c.reloptions, ', '))
+              END,
+              rtrim(pg_get_viewdef(c.oid), ';'))
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = %(source)s AND c.relkind = 'v'
+ORDER BY c.oid;
+"""
+
+
+class UnsupportedTemplate(Exception):
+    """The template schema contains objects which cannot be cloned"""
+
+
+def script_digest(topic: m.Topic) -> str:
+    """Returns the sha256 hexdigest of the topic's datamodel script"""
+    return get_script(topic).digest
+
+
+def snapshot_chain(topic: m.Topic) -> List[Tuple[str, Optional[m.Solution]]]:
+    """Returns the snapshot names of the topic, each with the solution which
+    leads from the previous snapshot to it.
+
+    The first snapshot is the template with the installed script. Every
+    non-select exercise adds a snapshot with its first solution applied.
+    Names are chained digests, so a changed script or solution renames all
+    following snapshots.
+    """
+    digest = hashlib.sha256(script_digest(topic).encode())
+    name = lambda: f"{TEMPLATE_PREFIX}{topic.short}_{digest.hexdigest()[:16]}"
+
+    chain: List[Tuple[str, Optional[m.Solution]]] = [(name(), None)]
+    for solution in get_catalog().changes(topic):
+        digest.update(b"\0" + solution.sql.encode())
+        chain.append((name(), solution))
+    return chain
+
+
+def snapshot_index(
+    chain: List[Tuple[str, Optional[m.Solution]]], exercise: m.Exercise
+) -> int:
+    """Returns the index of the snapshot with all solutions of previous
+    exercises applied"""
+    return sum(
+        1
+        for _, solution in chain[1:]
+        if solution.exercise.enumber < exercise.enumber  # type: ignore
+    )
+
+
+def build_snapshot(
+    conn: Connection,
+    topic: m.Topic,
+    chain: List[Tuple[str, Optional[m.Solution]]],
+    index: int,
+    reader: str,
+    force=False,
+):
+    """Builds the snapshot chain[index] if it does not exist.
+    It starts from the nearest earlier snapshot in the database and applies
+    the remaining solutions. Snapshots of the topic not in the chain are dropped.
+
+    Args:
+        conn: Connection of the service role with autocommit off
+        reader: role which may read the snapshot
+        force: rebuild the snapshot even if it exists
+    """
+    pattern = re.compile(rf"{re.escape(TEMPLATE_PREFIX + topic.short)}_[0-9a-f]{{16}}")
+    snapshot = chain[index][0]
+    with conn.cursor() as cursor:
+        # serialize concurrent builds of the same snapshot
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (snapshot,))
+        cursor.execute(
+            "SELECT nspname FROM pg_namespace WHERE starts_with(nspname, %s);",
+            (TEMPLATE_PREFIX + topic.short,),
+        )
+        existing = {row[0] for row in cursor.fetchall() if pattern.fullmatch(row[0])}
+        if snapshot in existing and not force:
+            conn.commit()
+            return
+
+        for schema in existing - {name for name, _ in chain}:
+            cursor.execute(
+                sql.SQL("DROP SCHEMA {} CASCADE;").format(sql.Identifier(schema))
+            )
+
+        start = next(
+            (i for i in range(index - 1, -1, -1) if chain[i][0] in existing), None
+        )
+        script = (
+            None if start is None else clone_script(conn, chain[start][0], snapshot)
+        )
+        if script is None:
+            start = 0
+            cursor.execute(
+                sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0};").format(
+                    sql.Identifier(snapshot)
+                )
+            )
+            cursor.execute(
+                sql.SQL("SET search_path TO {};").format(sql.Identifier(snapshot))
+            )
+            load_script(cursor, topic)
+        else:
+            cursor.execute(script)
+
+        for _, solution in chain[start + 1 : index + 1]:
+            try:
+                with conn.transaction():
+                    cursor.execute(solution.sql)  # type: ignore
+            except DatabaseError:
+                pass  # past solutions are replayed regardless of errors
+
+        cursor.execute(
+            sql.SQL(
+                "GRANT USAGE ON SCHEMA {0} TO {1};"
+                " GRANT SELECT ON ALL TABLES IN SCHEMA {0} TO {1};"
+                " GRANT SELECT ON ALL SEQUENCES IN SCHEMA {0} TO {1};"
+            ).format(sql.Identifier(snapshot), sql.Identifier(reader))
+        )
+    conn.commit()
+
+
+def clone_statements(cursor: Cursor, source: str) -> List[str]:
+    """Returns the statements which copy the source schema into the schema
+    currently on the search_path.
+
+    Names in the statements are not qualified with the target schema.
+
+    Raises:
+        UnsupportedTemplate: if the source contains objects like functions,
+            triggers or custom types which cannot be cloned
+    """
+    params = {"source": source}
+
+    cursor.execute(UNSUPPORTED_OBJECTS, params)
+    if cursor.fetchone()[0]:  # type: ignore
+        raise UnsupportedTemplate(source)
+
+    # resolve names in expressions and view definitions without the schema
+    cursor.execute(
+        sql.SQL("SET LOCAL search_path TO {};").format(sql.Identifier(source))
+    )
+
+    def fetch(query: str) -> List[tuple]:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+    sequences = fetch(SEQUENCES)
+    tables = fetch(TABLES)
+    defaults = fetch(DEFAULTS)
+    owners = fetch(SEQUENCE_OWNERS)
+    constraints = fetch(CONSTRAINTS)
+    indexes = fetch(INDEXES)
+    views = fetch(VIEWS)
+
+    # pg_get_indexdef always qualifies the table with its schema
+    qualified = fetch("SELECT quote_ident(%(source)s::text);")[0][0] + "."
+
+    return (
+        [create for create, _ in sequences]
+        + [create for create, _ in tables]
+        + [default for default, in defaults]
+        # load data before building indexes and checking constraints
+        + [insert for _, insert in tables]
+        + [setval for _, setval in sequences]
+        + [owner for owner, in owners]
+        + [constraint for constraint, in constraints]
+        + [index.replace(f" ON {qualified}", " ON ", 1) for index, in indexes]
+        + [view for view, in views]
+    )
+
+
+def clone_script(conn: Connection, source: str, target: str) -> Optional[str]:
+    """Returns the cached script which replaces the target schema by a copy of
+    the source schema. None if the source cannot be cloned."""
+    key = f"{source}.{target}"
+    with _clone_scripts_lock:
+        if key in _clone_scripts:
+            _clone_scripts.move_to_end(key)
+            return _clone_scripts[key]
+
+    # ends SET LOCAL without touching the surrounding transaction
+    with conn.transaction(force_rollback=True), conn.cursor() as cursor:
+        try:
+            statements: Optional[List[str]] = clone_statements(cursor, source)
+        except UnsupportedTemplate:
+            statements = None
+
+    script = None
+    if statements is not None:
+        target_id = sql.Identifier(target).as_string(conn)
+        target_literal = sql.Literal(target).as_string(conn)
+        script = ";\n".join(
+            [
+                # serialize concurrent resets of the same schema
+                f"SELECT pg_advisory_xact_lock(hashtext({target_literal}))",
+                f"DROP SCHEMA IF EXISTS {target_id} CASCADE",
+                f"CREATE SCHEMA {target_id}",
+                # temporary tables of the session can't shadow the copies
+                f"SET search_path TO {target_id}, pg_temp",
+            ]
+            + statements
+        )
+    with _clone_scripts_lock:
+        _clone_scripts[key] = script
+        if len(_clone_scripts) > MAX_CLONE_SCRIPTS:
+            _clone_scripts.popitem(last=False)
+    return script
+
+
+def prepare_snapshot(
+    conn: Connection,
+    topic: m.Topic,
+    chain: List[Tuple[str, Optional[m.Solution]]],
+    index: int,
+    force=False,
+):
+    """Builds the snapshot chain[index] in the database of the student's
+    connection with a connection of the service role, see build_snapshot.
+    Snapshots of the student's own role are dropped before.
+
+    Args:
+        conn: Connection of the student with autocommit off
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            STUDENT_SNAPSHOTS,
+            {"prefix": TEMPLATE_PREFIX, "service": service.service_user()},
+        )
+        for (schema,) in cursor.fetchall():
+            cursor.execute(
+                sql.SQL("DROP SCHEMA {} CASCADE;").format(sql.Identifier(schema))
+            )
+    conn.commit()
+    with service.connect_to_database_of(conn) as service_conn:
+        build_snapshot(service_conn, topic, chain, index, conn.info.user, force)
+
+
+def restore_snapshot(
+    conn: Connection,
+    topic: m.Topic,
+    chain: List[Tuple[str, Optional[m.Solution]]],
+    index: int,
+) -> bool:
+    """Replaces the topic schema with a copy of the snapshot chain[index].
+    The snapshot is built if it is missing or broken, see prepare_snapshot.
+
+    Args:
+        conn: Connection of the student with autocommit off
+
+    Returns:
+        False if the topic cannot be restored from a snapshot and its script
+         and past solutions need to be replayed instead.
+    """
+    snapshot = chain[index][0]
+    target = schema_name(conn, topic)
+    with _clone_scripts_lock:
+        known = f"{snapshot}.{target}" in _clone_scripts
+    if not known:
+        prepare_snapshot(conn, topic, chain, index)
+
+    script = clone_script(conn, snapshot, target)
+    if script is None:
+        return False
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(script)
+        conn.commit()
+    except DatabaseError:
+        # snapshot missing in this database
+        conn.rollback()
+        prepare_snapshot(conn, topic, chain, index, force=True)
+        with conn.cursor() as cursor:
+            cursor.execute(script)
+        conn.commit()
+    return True
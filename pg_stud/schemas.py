@@ -9,11 +9,13 @@ from ninja import Schema
 
 class Result(Schema):
     """Schema for result data and marking for wrong columns and rows.
-    Leave miss_* to default if no marking is needed"""
+    Leave miss_* to default if no marking is needed.
+    truncated is set if the result was cut off at the limits of the topic."""
 
     result: List[Dict[str, Any]]
     miss_cols: List[str] = []
     miss_rows: List[int] = []
+    truncated: bool = False
 
 
 class QueryIn(Schema):
@@ -40,3 +42,8 @@ class ExerciseSpeciIn(Schema):
 
 class Message(Schema):
     message: str
+
+
+class Metrics(Schema):
+    counters: Dict[str, int]
+    rates: Dict[str, float]
@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module caches the datamodel scripts of the topics in the process.
+
+Installs, resets and the snapshot names of every request need the script or
+its digest. The script is read once and kept until the file changes, which is
+noticed by its path, modification time and size, or the topic is saved in the
+admin. The cache holds at most PG_STUD_SCRIPT_CACHE_BYTES, the least recently
+used scripts are evicted.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from typing import Any, List, Optional, Tuple
+
+import sqlparse
+from django.conf import settings
+
+from exercises import models as m
+
+# path, modification time and size of a script file
+Stamp = Tuple[str, int, int]
+
+
+class Script:
+    """Datamodel script of a topic"""
+
+    def __init__(self, raw: bytes):
+        self.text = raw.decode()
+        self.digest = hashlib.sha256(raw).hexdigest()
+        # the statements and the plan are about the same size again each
+        self.size = 3 * len(raw)
+        # steps loading the script with COPY, see bulk_load
+        self.plan: Optional[List[Any]] = None
+        self.compiled = False
+
+    @cached_property
+    def statements(self) -> List[str]:
+        """The statements of the script, split once when first needed"""
+        return [s for s in map(str.strip, sqlparse.split(self.text)) if s]
+
+
+class ScriptCache:
+    """Least recently used scripts of the topics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scripts: "OrderedDict[str, Tuple[Stamp, Script]]" = OrderedDict()
+        self._size = 0
+
+    def get(self, topic: m.Topic) -> Script:
+        """Returns the script of the topic, read again if the file changed"""
+        path = topic.datamodel_script.path
+        stat = os.stat(path)
+        stamp = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._scripts.get(topic.short)
+            if entry and entry[0] == stamp:
+                self._scripts.move_to_end(topic.short)
+                return entry[1]
+
+        with open(path, "rb") as file:
+            script = Script(file.read())
+
+        with self._lock:
+            self._discard(topic.short)
+            if script.size <= settings.PG_STUD_SCRIPT_CACHE_BYTES:
+                self._scripts[topic.short] = (stamp, script)
+                self._size += script.size
+            while self._size > settings.PG_STUD_SCRIPT_CACHE_BYTES:
+                self._discard(next(iter(self._scripts)))
+        return script
+
+    def invalidate(self, topic_short: str) -> None:
+        """Drops the script of the topic"""
+        with self._lock:
+            self._discard(topic_short)
+
+    def _discard(self, topic_short: str) -> None:
+        """Must be called with _lock held"""
+        entry = self._scripts.pop(topic_short, None)
+        if entry:
+            self._size -= entry[1].size
+
+
+scripts = ScriptCache()
+
+
+def get_script(topic: m.Topic) -> Script:
+    """Returns the datamodel script of the topic"""
+    return scripts.get(topic)
@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module opens connections of the service role to the student hosts.
+
+Objects shared by students, like the snapshot schemas and the results of the
+solutions, are made on fresh connections of the service role
+PG_STUD_SERVICE_USER instead of the pooled connections of a student, whose
+session and schemas the student controls. The connections are not pooled,
+they are only needed when a shared object is missing.
+"""
+from typing import Any, Dict
+
+from django.conf import settings
+from psycopg import Connection
+
+from pg_stud.sharding import host_conninfo
+
+
+def conninfo(host: str, dbname: str) -> Dict[str, Any]:
+    """Returns the conninfo of the service role for the database on the host"""
+    return (
+        settings.PG_STUD_CONNINFO
+        | host_conninfo(host)
+        | {"user": settings.PG_STUD_SERVICE_USER, "dbname": dbname}
+        if settings.DEPLOY
+        else settings.PG_TEST_CONNINFO
+    )
+
+
+def service_user() -> str:
+    """Returns the name of the service role"""
+    return (
+        settings.PG_STUD_SERVICE_USER
+        if settings.DEPLOY
+        else settings.PG_TEST_CONNINFO["user"]
+    )
+
+
+def connect(host: str, dbname: str) -> Connection:
+    """Opens a connection of the service role to the database on the host"""
+    return Connection.connect(**conninfo(host, dbname))
+
+
+def host_of(conn: Connection) -> str:
+    """Returns the host of the connection as host:port"""
+    return f"{conn.info.host}:{conn.info.port}"
+
+
+def connect_to_database_of(conn: Connection) -> Connection:
+    """Opens a connection of the service role to the database of the
+    connection"""
+    return connect(host_of(conn), conn.info.dbname)
@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module spreads the students over the student database hosts.
+
+Each host is placed on a hash ring many times. A student belongs to the first
+host after the hash of the student's name, so adding or removing a host only
+moves the students between it and its neighbours.
+"""
+import bisect
+import hashlib
+from functools import lru_cache
+from typing import Dict, Iterator, Tuple
+
+# places of each host on the ring, more spread the students more evenly
+REPLICAS = 100
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring of hosts"""
+
+    def __init__(self, hosts: Tuple[str, ...]):
+        ring = sorted(
+            (ring_hash(f"{host}#{replica}"), host)
+            for host in hosts
+            for replica in range(REPLICAS)
+        )
+        self._hashes = [hash_ for hash_, _ in ring]
+        self._hosts = [host for _, host in ring]
+
+    def hosts(self, key: str) -> Iterator[str]:
+        """Yields each host once, in the order of the ring starting at the key"""
+        start = bisect.bisect(self._hashes, ring_hash(key))
+        seen = set()
+        for i in range(len(self._hosts)):
+            host = self._hosts[(start + i) % len(self._hosts)]
+            if host not in seen:
+                seen.add(host)
+                yield host
+
+
+@lru_cache(maxsize=4)
+def hash_ring(hosts: Tuple[str, ...]) -> HashRing:
+    """Returns the hash ring of the hosts"""
+    return HashRing(hosts)
+
+
+def host_conninfo(host: str) -> Dict[str, str]:
+    """Returns the conninfo of a host given as host[:port]"""
+    name, _, port = host.partition(":")
+    return {"host": name, "port": port} if port else {"host": name}
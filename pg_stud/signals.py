@@ -0,0 +1,39 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module drops the cached data of changed exercises and compiles their
+datamodel scripts"""
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from exercises import models as m
+from pg_stud.bulk_load import compile_topic, has_plan
+from pg_stud.scripts import get_script, scripts
+
+
+@receiver(post_save, sender=m.Topic)
+@receiver(post_delete, sender=m.Topic)
+def topic_changed(sender, instance: m.Topic, **kwargs):
+    """A new datamodel script may have been uploaded"""
+    scripts.invalidate(instance.short)
+
+
+@receiver(post_save, sender=m.Topic)
+def topic_saved(sender, instance: m.Topic, raw=False, **kwargs):
+    """Compiles the datamodel script after the commit, which is not done in
+    requests of students, see bulk_load. Fixtures are compiled by
+    compilescripts."""
+    if not raw:
+        transaction.on_commit(lambda: compile_script_of(instance))
+
+
+def compile_script_of(topic: m.Topic):
+    try:
+        if not has_plan(topic, get_script(topic)):
+            compile_topic(topic)
+    except Exception:
+        logging.exception("compiling the script of %s failed", topic.short)
@@ -0,0 +1,112 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module caches the results of the solutions of SELECT exercises.
+
+The result of the first solution is the same for every student, so it is
+computed once and stored in the database with the cache in front of it.
+The key is made of the solution SQL, the result limits of the topic and the
+snapshot of the exercise, which covers the datamodel script and the earlier
+non-SELECT solutions. Changing any of them changes the key and the result is
+computed again. Only results with rows are stored, errors and timeouts may
+not happen the next time.
+
+The result is not computed in the student's session or schema, which the
+student controls, e.g. with a temporary table shadowing a table of the topic.
+It is computed on a fresh connection of the service role, see service, in the
+database PG_STUD_SERVICE_DB of the student's host. The schema is installed
+and the earlier solutions are replayed in a transaction which is rolled back.
+"""
+import hashlib
+import pickle
+
+from django.conf import settings
+from django.core.cache import cache
+from psycopg import sql
+from psycopg.connection import Connection
+
+from exercises import models as m
+from exercises.catalog import get_catalog
+from pg_stud import metrics, service
+from pg_stud.bulk_load import load_script
+from pg_stud.models import SolutionResult
+from pg_stud.schema_templates import snapshot_chain, snapshot_index
+from pg_stud.tenancy import StudentConnection, schema_name
+from pg_stud.utils import Rows, execute, set_search_path
+
+PREFIX = "pg_stud:solution:"
+# keys of the results of execute which are not rows
+FAILURES = ("error_in_query", "query_timeout", "no_output")
+# prefix of the topic schemas in PG_STUD_SERVICE_DB, which is the test database
+# without DEPLOY
+SCHEMA_PREFIX = "_solution_"
+
+
+def result_key(topic: m.Topic, exercise: m.Exercise, solution: m.Solution) -> str:
+    """Returns the key of the solution result"""
+    chain = snapshot_chain(topic)
+    snapshot = chain[snapshot_index(chain, exercise)][0]
+    max_rows = topic.max_rows or settings.PG_STUD_MAX_ROWS
+    max_bytes = topic.max_bytes or settings.PG_STUD_MAX_BYTES
+    return hashlib.sha256(
+        f"{snapshot}\0{max_rows}\0{max_bytes}\0{solution.sql}".encode()
+    ).hexdigest()
+
+
+def get_solution_result(conn: Connection, topic: m.Topic, exercise: m.Exercise) -> Rows:
+    """Returns the result of the first solution of the exercise.
+    On a miss it is computed on the host of the student's connection, see
+    compute_result.
+    """
+    solution = get_catalog().first_solution(exercise)
+    key = result_key(topic, exercise, solution)
+    metrics.incr("solution_total")
+
+    result = cache.get(PREFIX + key)
+    if result is not None:
+        metrics.incr("solution_cached")
+        return result
+
+    stored = SolutionResult.objects.filter(exercise=exercise, key=key).first()
+    if stored is not None:
+        result = pickle.loads(stored.result)
+        cache.set(PREFIX + key, result, timeout=None)
+        metrics.incr("solution_cached")
+        return result
+
+    result = compute_result(service.host_of(conn), topic, exercise, solution)
+    if not any(failure in result[0] for failure in FAILURES):
+        SolutionResult.objects.update_or_create(
+            exercise=exercise, defaults={"key": key, "result": pickle.dumps(result)}
+        )
+        cache.set(PREFIX + key, result, timeout=None)
+    return result
+
+
+def compute_result(
+    host: str, topic: m.Topic, exercise: m.Exercise, solution: m.Solution
+) -> Rows:
+    """Executes the solution on a fresh connection of the service role in
+    PG_STUD_SERVICE_DB on the host. The schema of the topic is installed and
+    the earlier solutions are replayed before, all of it is rolled back."""
+    changes = [
+        change
+        for change in get_catalog().changes(topic)
+        if change.exercise.enumber < exercise.enumber
+    ]
+    with StudentConnection.connect(
+        **service.conninfo(host, settings.PG_STUD_SERVICE_DB)
+    ) as conn:
+        conn.schema_prefix = SCHEMA_PREFIX
+        with conn.transaction(force_rollback=True), conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("CREATE SCHEMA {};").format(
+                    sql.Identifier(schema_name(conn, topic))
+                )
+            )
+            set_search_path(cursor, topic)
+            load_script(cursor, topic)
+            for change in changes:
+                execute(conn, change.sql, topic, savepoint=True)
+            return execute(conn, solution.sql, topic, savepoint=True, exercise=exercise)
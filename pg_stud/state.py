@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module is for tracking the state of topic schemas, so resets of
+schemas which were not modified since their last reset can be skipped.
+
+After a reset the schema is marked clean with the snapshot it was reset to.
+Any query which writes to the database marks it dirty. The marks are kept in
+the cache, a missing mark means the schema needs a reset. They are only used
+with PG_STUD_SKIP_CLEAN_RESETS, as they need a cache shared by all processes.
+
+Installed schemas are registered in the model InstalledSchema with the cache
+in front of it. Students can drop their schemas, so only schemas registered
+as missing are not looked up in the student database.
+"""
+import hashlib
+from typing import Optional
+
+from django.core.cache import cache
+from psycopg.connection import Connection
+from psycopg.pq import TransactionStatus
+
+from exercises import models as m
+from pg_stud.models import InstalledSchema
+from pg_stud.tenancy import schema_name
+
+INSTALLED_PREFIX = "pg_stud:installed:"
+
+WRITTEN_QUERY = "SELECT pg_current_xact_id_if_assigned() IS NOT NULL;"
+
+
+def schema_key(conn: Connection, topic: m.Topic) -> str:
+    """Returns the cache key of the topic schema in the connection's database"""
+    info = conn.info
+    schema = f"{info.host}:{info.port}/{info.dbname}/{schema_name(conn, topic)}"
+    return "pg_stud:state:" + hashlib.sha1(schema.encode()).hexdigest()
+
+
+def get_state(conn: Connection, topic: m.Topic) -> Optional[str]:
+    """Returns the snapshot the schema was reset to. None if it is dirty."""
+    return cache.get(schema_key(conn, topic))
+
+
+def mark_clean(conn: Connection, topic: m.Topic, snapshot: str) -> None:
+    cache.set(schema_key(conn, topic), snapshot, timeout=None)
+
+
+def mark_dirty(conn: Connection, topic: m.Topic) -> None:
+    cache.delete(schema_key(conn, topic))
+
+
+def get_installed(conn: Connection, topic: m.Topic) -> Optional[bool]:
+    """Returns if the schema is installed by the registry. None if unknown."""
+    key = schema_key(conn, topic)
+    installed = cache.get(INSTALLED_PREFIX + key)
+    if installed is None and InstalledSchema.objects.filter(key=key).exists():
+        installed = True
+        cache.set(INSTALLED_PREFIX + key, installed, timeout=None)
+    return installed
+
+
+def set_installed(conn: Connection, topic: m.Topic, installed: bool) -> None:
+    key = schema_key(conn, topic)
+    if installed:
+        InstalledSchema.objects.update_or_create(key=key, defaults={"topic": topic})
+    else:
+        InstalledSchema.objects.filter(key=key).delete()
+    cache.set(INSTALLED_PREFIX + key, installed, timeout=None)
+
+
+def forget_installed(conn: Connection, topic: m.Topic) -> None:
+    """The registry may be wrong, the student database is asked again"""
+    key = schema_key(conn, topic)
+    InstalledSchema.objects.filter(key=key).delete()
+    cache.delete(INSTALLED_PREFIX + key)
+
+
+def commit_written(conn: Connection) -> bool:
+    """Commits the current transaction in one round trip.
+
+    Returns:
+        True if the transaction has written to the database. True as well if
+        the transaction was ended by the executed query itself.
+    """
+    if conn.info.transaction_status != TransactionStatus.INTRANS:
+        return True
+    with conn.cursor() as cursor:
+        # Not in pipeline mode, which fails right after a streamed query
+        cursor.execute(WRITTEN_QUERY + " COMMIT;")
+        return cursor.fetchone()[0]  # type: ignore
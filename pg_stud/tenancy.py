@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2023 2023, Nicolas Bota, Marcel Geiger, Florian Paul, Rajbir Singh, Niklas Sirch, Jan Swiridow, Duc Minh Vu, Mike Wegele
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""This module maps the topic schemas of a student to schemas in the database.
+
+With PG_STUD_TENANCY "database" every student has an own database, the topic
+schemas are named after the topics. With "shared_database" the students share
+the database PG_STUD_SHARED_DB and the topic schemas are prefixed with the
+name of the student. In both modes every student has a pool of connections of
+the student's own login role.
+"""
+import hashlib
+from typing import Any, Callable
+
+from django.conf import settings
+from psycopg import Connection
+
+from exercises import models as m
+
+# Schema names have at most 63 bytes, topic shorts at most 10 characters
+MAX_PREFIX = 52
+
+
+class StudentConnection(Connection[Any]):
+    """Connection which knows the schema prefix of its student"""
+
+    schema_prefix = ""
+
+
+def schema_prefix(lms_username: str) -> str:
+    """Returns the prefix of the student's schemas. Too long names are hashed."""
+    if len(lms_username.encode()) > MAX_PREFIX:
+        lms_username = hashlib.sha256(lms_username.encode()).hexdigest()[:MAX_PREFIX]
+    return lms_username + "_"
+
+
+def schema_name(conn: Connection, topic: m.Topic) -> str:
+    """Returns the name of the topic's schema for the student of the connection"""
+    return getattr(conn, "schema_prefix", "") + topic.short
+
+
+def configure(lms_username: str) -> Callable[[StudentConnection], None]:
+    """Returns the function configuring the connections of the student's pool"""
+    prefix = (
+        schema_prefix(lms_username)
+        if settings.PG_STUD_TENANCY == "shared_database"
+        else ""
+    )
+
+    def configure_(conn: StudentConnection) -> None:
+        conn.schema_prefix = prefix
+
+    return configure_
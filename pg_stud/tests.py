@@ -2,38 +2,82 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import ctypes
+import asyncio
 import json
 import os
-import sys
+import pickle
+import tempfile
 import threading
+import time
 import unittest
+from collections import Counter
+from multiprocessing.connection import Listener
 from unittest.mock import MagicMock, patch
 
+import psycopg
+from asgiref.sync import async_to_sync
 from django.conf import settings
-from django.test import RequestFactory, TestCase, tag
+from django.http import Http404
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+    tag,
+)
+from psycopg_pool import ConnectionPool, PoolTimeout
 
 import exercises.models as m
-import pg_stud
+from exercises.catalog import catalog
 from ltiapi.models import LTIUser
+from pg_stud import api
 from pg_stud.api import (
     ExerciseSpeciIn,
     Message,
     QueryIn,
     QueryOut,
     Result,
-    check_answer_correct_api,
-    check_or_install_db,
-    execute_query,
-    is_installed,
-    reset_db,
-    solution_result,
 )
+from pg_stud import metrics
+from pg_stud.admission import Throttled, TokenBucket, admit
+from pg_stud.breaker import CircuitBreaker
+from pg_stud.bulk_load import compile_script, run_plan
+from pg_stud.broker import authkey, serve
+from pg_stud.comparison import missing_rows
+from pg_stud.evaluation import check_results
+from pg_stud.metrics_api import get_metrics
+from pg_stud.models import CompiledScript, SolutionResult
+from pg_stud.offload import offload
 from pg_stud.pg_conn_pool import PgConnPool
+from pg_stud.schema_templates import clone_script, restore_snapshot, snapshot_chain
+from pg_stud.sharding import HashRing
+from pg_stud.scripts import Script, ScriptCache, scripts
+from pg_stud.single_flight import SingleFlight
+from pg_stud.solution_cache import get_solution_result, result_key
+from pg_stud.tenancy import StudentConnection
+from pg_stud.utils import (
+    describe,
+    ensure_installed,
+    execute,
+    execute_check,
+    install_db,
+    is_installed,
+    uninstall_db,
+    warm_up,
+)
 from sql_training.settings import FIXTURE_DIRS
 
+# The views are async. With PG_STUD_THREADS 0 they run in the test's thread,
+# which sees the fixtures of the test's transaction.
+check_answer_correct_api = async_to_sync(api.check_answer_correct_api)
+check_or_install_db = async_to_sync(api.check_or_install_db)
+execute_query = async_to_sync(api.execute_query)
+reset_db = async_to_sync(api.reset_db)
+solution_result = async_to_sync(api.solution_result)
+
 
 @unittest.skipIf(False, "Skip pg_stud test")
+@override_settings(PG_STUD_THREADS=0)
 class PgStudTestCase(TestCase):
     fixtures = [
         # "exercises/fixtures/common_test.yaml",
@@ -48,6 +92,8 @@ class PgStudTestCase(TestCase):
         settings.MEDIA_ROOT = settings.BASE_DIR / "exercises/fixtures/"
         self.maxDiff = None
         self.user = LTIUser.objects.create_user(username="mitro", password="testpw")
+        # the catalog may have been loaded before a rollback
+        catalog.invalidate()
 
     # how uninstall schema in order to test?
     def test_check_or_install_db(self):
@@ -56,7 +102,7 @@ class PgStudTestCase(TestCase):
         request.user = self.user
 
         response = check_or_install_db(request, data)
-        with PgConnPool().get_pool(self.user).connection() as conn:
+        with PgConnPool().connection(self.user) as conn:
             self.assertTrue(is_installed(conn, topic=m.Topic.objects.get(short="pc")))
 
         expected_data = {"message": "Already Installed!"}
@@ -101,6 +147,7 @@ class PgStudTestCase(TestCase):
                 ],
                 "miss_cols": [],
                 "miss_rows": [],
+                "truncated": False,
             }
         }
         self.assertDictEqual(select_response_dict, empty_response)
@@ -144,10 +191,459 @@ class PgStudTestCase(TestCase):
                 ],
                 "miss_cols": [],
                 "miss_rows": [],
+                "truncated": False,
             }
         }
         self.assertDictEqual(select_response_dict, expected_response)
 
+    @override_settings(PG_STUD_SKIP_CLEAN_RESETS=1)
+    def test_reset_db_skips_clean_schema(self):
+        data = ExerciseSpeciIn(topic_short="pc", enumber=1)
+        request = self.factory.post("/api/pg-stud/reset_db/", data.dict())
+        request.user = self.user
+
+        reset_db(request, data)
+        before = metrics.counters()
+        reset_db(request, data)
+        after = metrics.counters()
+        self.assertEqual(after["reset_total"] - before["reset_total"], 1)
+        self.assertEqual(after["reset_skipped"] - before["reset_skipped"], 1)
+
+        # a modified schema is reset again
+        query = QueryIn(topic_short="pc", enumber=1, query="delete from photo")
+        query_request = self.factory.post("/api/pg-stud/execute_query/", query.dict())
+        query_request.user = self.user
+        execute_query(query_request, query)
+        reset_db(request, data)
+        self.assertEqual(metrics.counters()["reset_skipped"], after["reset_skipped"])
+
+        query.query = "select count(*) from photo"
+        response = execute_query(query_request, query)
+        self.assertEqual(response.result.result, [{"count": 5}])
+
+        self.user.is_staff = True
+        metrics_request = self.factory.get("/api/pg-stud/metrics/")
+        metrics_request.user = self.user
+        response = get_metrics(metrics_request)
+        self.assertGreater(response.rates["reset_skip_rate"], 0)
+
+        # the marks of a cache local to the process are not trusted
+        reset_db(request, data)
+        with self.settings(PG_STUD_SKIP_CLEAN_RESETS=0):
+            before = metrics.counters()
+            reset_db(request, data)
+        self.assertEqual(metrics.counters()["reset_skipped"], before["reset_skipped"])
+
+    def test_execute_multiple_statements(self):
+        data = ExerciseSpeciIn(topic_short="pc", enumber=1)
+        request = self.factory.post("/api/pg-stud/reset_db/", data.dict())
+        request.user = self.user
+        reset_db(request, data)
+
+        # multiple statements are not pipelined and may commit on their own
+        query = QueryIn(
+            topic_short="pc",
+            enumber=1,
+            query="delete from photo; commit; select * from missing;",
+        )
+        query_request = self.factory.post("/api/pg-stud/execute_query/", query.dict())
+        query_request.user = self.user
+        execute_query(query_request, query)
+        reset_db(request, data)
+
+        query.query = "select count(*) from photo"
+        response = execute_query(query_request, query)
+        self.assertEqual(response.result.result, [{"count": 5}])
+
+    def test_execute_truncated(self):
+        m.Topic.objects.filter(short="pc").update(max_rows=2)
+        catalog.invalidate()  # updates do not send signals
+        data = QueryIn(topic_short="pc", enumber=1, query="select * from photo")
+        request = self.factory.post("/api/pg-stud/execute_query/", data.dict())
+        request.user = self.user
+        reset_db(request, ExerciseSpeciIn(topic_short="pc", enumber=1))
+
+        for query in ("select * from photo", "select * from photo; select 1;"):
+            data.query = query
+            response = execute_query(request, data)
+            self.assertTrue(response.result.truncated)
+            self.assertEqual(len(response.result.result), 2)
+
+        m.Topic.objects.filter(short="pc").update(max_rows=None, max_bytes=20)
+        catalog.invalidate()
+        data.query = "select * from photo"
+        response = execute_query(request, data)
+        self.assertTrue(response.result.truncated)
+        self.assertEqual(response.result.result[0]["photo"], "")
+
+        # the connection is usable after the query was cancelled
+        data.query = "select count(*) from photo"
+        response = execute_query(request, data)
+        self.assertFalse(response.result.truncated)
+        self.assertEqual(response.result.result, [{"count": 5}])
+
+        # writes are not cancelled at the limits
+        m.Topic.objects.filter(short="pc").update(max_rows=2, max_bytes=None)
+        catalog.invalidate()
+        for query in (
+            "update photo set title = title || '!' returning photo",
+            "select * from photo; update photo set title = title || '!';",
+        ):
+            data.query = query
+            response = execute_query(request, data)
+            self.assertTrue(response.result.truncated)
+            self.assertEqual(len(response.result.result), 2)
+        data.query = "select count(*) from photo where title like '%!!'"
+        response = execute_query(request, data)
+        self.assertEqual(response.result.result, [{"count": 5}])
+
+    def test_describe(self):
+        topic = m.Topic.objects.get(short="pc")
+        with PgConnPool().connection(self.user) as conn:
+            ensure_installed(conn, topic)
+            self.assertEqual(
+                execute(conn, "select * from photo where false; select 1", topic)[0],
+                dict.fromkeys(
+                    ["photo", "title", "date", "source", "type", "height", "width"],
+                    "",
+                ),
+            )
+            with self.assertRaises(psycopg.errors.UndefinedTable):
+                describe(conn, "select * from missing")
+            conn.rollback()
+
+    @override_settings(PG_STUD_MAX_CONNECTIONS=3, PG_STUD_POOL_TIMEOUT=0.5)
+    def test_connection_budget(self):
+        other = LTIUser.objects.create_user(
+            username="other", password="testpw", lms_username="other"
+        )
+        pools = PgConnPool()
+        with pools.connection(self.user):
+            # the budget is used up by the pool in use
+            with self.assertRaises(PoolTimeout):
+                with pools.connection(other):
+                    pass
+
+            # a waiting request gets the pool released by the other request
+            waited = threading.Event()
+
+            def wait():
+                with pools.connection(other):
+                    waited.set()
+
+            thread = threading.Thread(target=wait)
+            thread.start()
+        thread.join()
+        self.assertTrue(waited.is_set())
+        # the idle pool was evicted
+        host = pools.hosts()[0]
+        self.assertNotIn(f"{self.user.lms_username}@{host}", pools._user_pools)
+        self.assertIn(f"{other.lms_username}@{host}", pools._user_pools)
+
+    def test_pool_single_flight(self):
+        pools = PgConnPool()
+        host = pools.hosts()[0]
+        created = []
+        threads = [
+            threading.Thread(
+                target=lambda: created.append(pools._checkout("single_flight", host))
+            )
+            for _ in range(3)
+        ]
+        with patch(
+            "pg_stud.pg_conn_pool.ConnectionPool", wraps=ConnectionPool
+        ) as pool_class:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        pool_class.assert_called_once()
+        self.assertEqual([item.leases for item in created], [3, 3, 3])
+        with pools._changed:
+            created[0].leases = 0
+
+    def shared_database(self, lms_username: str):
+        """Creates the login role of the student, which is dropped with its
+        schemas after the test. Returns the settings of the shared database
+        tenancy."""
+        self.user.lms_username = lms_username
+        admin = psycopg.connect(**settings.PG_TEST_CONNINFO, autocommit=True)
+        self.addCleanup(admin.close)
+        admin.execute(f"CREATE ROLE {lms_username} LOGIN")
+        admin.execute(f"GRANT CREATE ON DATABASE {admin.info.dbname} TO {lms_username}")
+        self.addCleanup(
+            admin.execute, f"DROP OWNED BY {lms_username}; DROP ROLE {lms_username}"
+        )
+        pools = PgConnPool()
+        host = pools.hosts()[0]
+
+        def close_pool():
+            with pools._changed:
+                item = pools._user_pools.get(f"{lms_username}@{host}")
+                if item:
+                    pools._remove(f"{lms_username}@{host}")
+            if item:
+                pools._close([item])
+
+        self.addCleanup(close_pool)
+        conninfo = settings.PG_TEST_CONNINFO
+        return self.settings(
+            DEPLOY=True,
+            PG_STUD_TENANCY="shared_database",
+            PG_STUD_HOSTS=[host],
+            PG_STUD_SHARED_DB=conninfo["dbname"],
+            PG_STUD_CONNINFO={"password": conninfo["password"]},
+        )
+
+    def test_shared_database_tenancy(self):
+        with self.shared_database("role_test"):
+            data = ExerciseSpeciIn(topic_short="pc", enumber=1)
+            request = self.factory.post("/api/pg-stud/reset_db/")
+            request.user = self.user
+            reset_db(request, data)
+
+            query = "SELECT count(*) FROM photo"
+            data = QueryIn(topic_short="pc", enumber=1, query=query)
+            response = execute_query(request, data)
+            self.assertEqual(response.result.result, [{"count": 5}])
+            # the student connects with the own login role
+            data.query = "RESET ROLE"
+            execute_query(request, data)
+            data.query = "SELECT current_user, session_user"
+            response = execute_query(request, data)
+        self.assertEqual(
+            response.result.result,
+            [{"current_user": "role_test", "session_user": "role_test"}],
+        )
+
+        admin = psycopg.connect(**settings.PG_TEST_CONNINFO, autocommit=True)
+        self.addCleanup(admin.close)
+        owner = admin.execute(
+            "SELECT nspowner::regrole::text FROM pg_namespace WHERE nspname = %s",
+            ("role_test_pc",),
+        ).fetchone()
+        self.assertEqual(owner, ("role_test",))
+        # other students cannot use the schemas
+        admin.execute("CREATE ROLE role_other")
+        self.addCleanup(admin.execute, "DROP ROLE role_other")
+        admin.execute("SET ROLE role_other")
+        with self.assertRaises(psycopg.errors.InsufficientPrivilege):
+            admin.execute("SELECT FROM role_test_pc.photo")
+        admin.execute("RESET ROLE")
+
+    def test_warm_up(self):
+        with self.shared_database("warm_up"), self.settings(PG_STUD_WARM_UP="install"):
+            warm_up(self.user)
+            with PgConnPool().connection(self.user) as conn:
+                self.assertTrue(is_installed(conn, m.Topic.objects.get(short="pc")))
+
+    @override_settings(
+        PG_STUD_ADMISSION={"check": {"concurrency": 0, "rate": 0.01, "burst": 1}}
+    )
+    def test_admission(self):
+        self.client.force_login(self.user)
+        data = {"topic_short": "pc", "enumber": 1}
+        response = self.client.post(
+            "/api/pg-stud/reset_db/", data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            "/api/pg-stud/reset_db/", data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "100")
+
+    def test_installed_registry(self):
+        topic = m.Topic.objects.get(short="pc")
+        data = QueryIn(topic_short="pc", enumber=1, query="SELECT count(*) FROM photo")
+        request = self.factory.post("/api/pg-stud/execute_query/", data.dict())
+        request.user = self.user
+        with PgConnPool().connection(self.user) as conn:
+            ensure_installed(conn, topic)
+            with patch("pg_stud.utils.set_installed") as set_installed:
+                # known to be missing without asking the student database
+                with patch("pg_stud.utils.get_installed", return_value=False):
+                    with patch.object(conn, "cursor") as cursor:
+                        self.assertFalse(is_installed(conn, topic))
+                cursor.assert_not_called()
+
+                # installed behind the registry's back
+                with conn.cursor() as cursor:
+                    uninstall_db(cursor, topic)
+                    install_db(cursor, topic)
+                conn.commit()
+            set_installed(conn, topic, False)
+            self.assertFalse(ensure_installed(conn, topic))
+            self.assertTrue(is_installed(conn, topic))
+
+            # a typo does not make the registry ask again
+            with patch("pg_stud.utils.forget_installed") as forget_installed:
+                result = execute(conn, "SELECT * FROM fotos", topic)
+            self.assertIn("no_output", result[0])
+            forget_installed.assert_not_called()
+
+            # dropped behind the registry's back
+            conn.execute("DROP SCHEMA pc CASCADE")
+            conn.commit()
+        self.assertIn("no_output", execute_query(request, data).result.result[0])
+        with PgConnPool().connection(self.user) as conn:
+            self.assertTrue(ensure_installed(conn, topic))
+        self.assertEqual(execute_query(request, data).result.result, [{"count": 5}])
+
+        # dropped by the student, the registry is not trusted
+        data.query = "DROP SCHEMA pc CASCADE"
+        execute_query(request, data)
+        install = ExerciseSpeciIn(topic_short="pc", enumber=1)
+        response = check_or_install_db(request, install)
+        self.assertEqual(response.message, "Installed Successfully!")
+
+    def test_session_state(self):
+        topic = m.Topic.objects.get(short="pc")
+        query = "SELECT count(*) FROM photo"
+        with PgConnPool().connection(self.user) as conn:
+            ensure_installed(conn, topic)
+            count = execute(conn, query, topic)
+            self.assertIn("count", count[0])
+
+            # changed by the student in ways not visible in the query
+            execute(
+                conn,
+                """CREATE FUNCTION pg_temp.f() RETURNS text LANGUAGE sql
+                    AS $$ SELECT set_config('search_path', 'public', false) $$;
+                SELECT pg_temp.f();""",
+                topic,
+            )
+            self.assertEqual(execute(conn, query, topic), count)
+
+            # prepared statements deallocated by the student
+            execute(conn, "DO $$ BEGIN EXECUTE 'DEALLOCATE ' || 'ALL'; END $$", topic)
+            for _ in range(6):
+                self.assertEqual(execute(conn, query, topic), count)
+                self.assertTrue(execute_check(conn, "SELECT true", topic))
+
+    @patch("pg_stud.bulk_load.MIN_ROWS", 1)
+    def test_bulk_load(self):
+        topic = m.Topic.objects.get(short="pc")
+        scripts.invalidate("pc")
+
+        def install():
+            with PgConnPool().connection(self.user) as conn:
+                conn.autocommit = False
+                with conn.cursor() as cursor:
+                    if is_installed(conn, topic):
+                        uninstall_db(cursor, topic)
+                    install_db(cursor, topic)
+                    rows = cursor.execute("SELECT * FROM photo;").fetchall()
+                conn.commit()
+            return rows
+
+        photos = install()
+        self.assertEqual(len(photos), 5)
+        # the script is not compiled in the session of a student
+        self.assertFalse(CompiledScript.objects.filter(topic=topic).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            topic.save()
+        self.assertEqual(install(), photos)
+        plan = pickle.loads(CompiledScript.objects.get(topic=topic).plan)
+        self.assertIn(
+            "COPY photo (photo, title, date, source, type, height, width) FROM STDIN",
+            [step[0] for step in plan if isinstance(step, tuple)],
+        )
+
+    @patch("pg_stud.bulk_load.MIN_ROWS", 2)
+    def test_compile_script(self):
+        script = Script(
+            b"""CREATE TABLE t (id serial PRIMARY KEY, at timestamp, note text);
+            INSERT INTO t (at, note) VALUES (TIMESTAMP '2023-12-15 00:12:46', 'a\tb');
+            -- comment
+            INSERT INTO t (at, note) VALUES (now()::date, NULL), (NULL, 'it''s');
+            CREATE VIEW v AS SELECT count(*) FROM t"""
+        )
+        with psycopg.connect(**settings.PG_TEST_CONNINFO) as conn:
+            cursor = conn.cursor()
+            cursor.execute("CREATE SCHEMA bulk_a; SET search_path TO bulk_a;")
+            plan = compile_script(cursor, script)
+            compiled = cursor.execute("SELECT * FROM t ORDER BY id;").fetchall()
+            cursor.execute("CREATE SCHEMA bulk_b; SET search_path TO bulk_b;")
+            run_plan(cursor, plan)  # type: ignore
+            self.assertEqual(
+                cursor.execute("SELECT * FROM t ORDER BY id;").fetchall(), compiled
+            )
+            # the sequence continues after the copied rows
+            cursor.execute("INSERT INTO t DEFAULT VALUES RETURNING id;")
+            self.assertEqual(cursor.fetchone(), (4,))
+            self.assertEqual(cursor.execute("SELECT * FROM v;").fetchone(), (4,))
+            # the rows of consecutive inserts are copied at once
+            steps = sum(isinstance(step, tuple) for step in plan)  # type: ignore
+            self.assertEqual(steps, 1)
+
+            # a copy of a single row is not worth it
+            cursor.execute("CREATE SCHEMA bulk_c; SET search_path TO bulk_c;")
+            script = Script(b"CREATE TABLE t (a int); INSERT INTO t VALUES (1);")
+            self.assertIsNone(compile_script(cursor, script))
+            table = cursor.execute("SELECT to_regclass('t');").fetchone()
+            self.assertIsNone(table[0])  # type: ignore
+            conn.rollback()
+
+        script = Script(
+            b"CREATE TABLE t (a int); BEGIN; INSERT INTO t VALUES (1); COMMIT;"
+        )
+        self.assertIsNone(compile_script(MagicMock(), script))
+
+    @patch("pg_stud.bulk_load.MIN_ROWS", 1)
+    def test_compile_script_session_settings(self):
+        """The copied rows do not depend on the settings of the session"""
+        script = Script(
+            """CREATE TABLE t (d date, i interval, f float8, ts timestamptz,
+              b bytea, s text);
+            INSERT INTO t VALUES ('2005-03-20', '-1 day 02:00', 0.1 + 0.2,
+              '2023-12-15 00:12:46+01', '\\x00ff', 'Straße')""".encode()
+        )
+        with psycopg.connect(**settings.PG_TEST_CONNINFO) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SET DateStyle TO SQL, DMY; SET IntervalStyle TO sql_standard;
+                SET extra_float_digits TO -15; SET TimeZone TO 'Asia/Kolkata';
+                SET bytea_output TO escape; SET client_encoding TO LATIN1;
+                CREATE SCHEMA bulk_a; SET search_path TO bulk_a;"""
+            )
+            plan = compile_script(cursor, script)
+            self.assertIsNotNone(plan)
+            # restored after the copy
+            self.assertEqual(
+                cursor.execute("SHOW DateStyle;").fetchone(), ("SQL, DMY",)
+            )
+            cursor.execute(
+                """SET DateStyle TO German, MDY; SET IntervalStyle TO postgres;
+                SET extra_float_digits TO 0; SET TimeZone TO 'America/Denver';
+                SET client_encoding TO UTF8;
+                CREATE SCHEMA bulk_b; SET search_path TO bulk_b;"""
+            )
+            run_plan(cursor, plan)  # type: ignore
+            cursor.execute("RESET ALL;")
+            self.assertEqual(
+                cursor.execute("SELECT * FROM bulk_b.t;").fetchall(),
+                cursor.execute("SELECT * FROM bulk_a.t;").fetchall(),
+            )
+            conn.rollback()
+
+    def test_execute_timeout(self):
+        m.Topic.objects.filter(short="pc").update(statement_timeout=50)
+        catalog.invalidate()  # updates do not send signals
+        data = QueryIn(topic_short="pc", enumber=1, query="select pg_sleep(1)")
+        request = self.factory.post("/api/pg-stud/execute_query/", data.dict())
+        request.user = self.user
+
+        response = execute_query(request, data)
+        self.assertIn("query_timeout", response.result.result[0])
+
+        # the exercise overrides the topic
+        m.Exercise.objects.filter(enumber=1).update(statement_timeout=0)
+        catalog.invalidate()
+        data.query = "select pg_sleep(0.1)"
+        response = execute_query(request, data)
+        self.assertEqual(response.result.result, [{"pg_sleep": ""}])
+
     def test_execute_query(self):
         # Create request and input data
         data = QueryIn(
@@ -180,6 +676,7 @@ class PgStudTestCase(TestCase):
                 ],
                 "miss_cols": [],
                 "miss_rows": [],
+                "truncated": False,
             }
         }
         self.assertDictEqual(response_dict, expected_response)
@@ -205,16 +702,104 @@ class PgStudTestCase(TestCase):
                 "result": [{"date": "20.03.2005"}],
                 "miss_cols": [],
                 "miss_rows": [],
+                "truncated": False,
             },
             "solu_result": {
                 "result": [{"date": "20.03.2005"}],
                 "miss_cols": [],
                 "miss_rows": [],
+                "truncated": False,
             },
         }
         # compare both dictionaries
         self.assertDictEqual(response_dict, expected_data)
 
+    def test_check_answer_error(self):
+        data = QueryIn(topic_short="pc", enumber=3, query="SELECT * FROM missing;")
+        request = self.factory.post("/api/pg-stud/check_answer_correct/", data.dict())
+        request.user = self.user
+
+        response = check_answer_correct_api(request, data)
+        self.assertFalse(response.correct)
+        self.assertEqual(response.solu_result.result, [{"date": "20.03.2005"}])
+
+    @override_settings(
+        PG_STUD_COMPARE_MODE="database",
+        PG_STUD_ADMISSION={"check": {"concurrency": 0, "rate": 0, "burst": 0}},
+    )
+    def test_check_answer_in_database(self):
+        self.test_check_answer_correct()
+        self.test_check_answer_error()
+
+        data = QueryIn(
+            topic_short="pc",
+            enumber=3,
+            query="SELECT TO_CHAR(date,'dd.mm.yyyy') date FROM photo -- all",
+        )
+        request = self.factory.post("/api/pg-stud/check_answer_correct/", data.dict())
+        request.user = self.user
+        response = check_answer_correct_api(request, data)
+        self.assertFalse(response.correct)
+        self.assertEqual(response.solu_result.miss_rows, [])
+        self.assertEqual(len(response.user_result.miss_rows), 4)
+
+        m.Exercise.objects.filter(enumber=3).update(check_order=True)
+        m.Solution.objects.filter(exercise__enumber=3).update(
+            sql="SELECT photo FROM photo ORDER BY photo"
+        )
+        catalog.invalidate()  # updates do not send signals
+        data.query = "SELECT photo FROM photo ORDER BY photo DESC"
+        response = check_answer_correct_api(request, data)
+        self.assertFalse(response.correct)
+        self.assertEqual(response.user_result.miss_rows, [0, 1, 3, 4])
+        data.query = "SELECT photo FROM photo ORDER BY 1"
+        self.assertTrue(check_answer_correct_api(request, data).correct)
+
+        # differences after the sample
+        data.query = """SELECT photo FROM photo
+            ORDER BY CASE photo WHEN 'stgl' THEN 'a' ELSE photo END"""
+        with self.settings(PG_STUD_COMPARE_SAMPLE=2):
+            response = check_answer_correct_api(request, data)
+        self.assertFalse(response.correct)
+        self.assertEqual(response.user_result.miss_rows, [0, 1])
+        with self.settings(PG_STUD_COMPARE_SAMPLE=2):
+            data.query = "SELECT photo FROM photo ORDER BY photo = 'stgl', photo"
+            self.assertTrue(check_answer_correct_api(request, data).correct)
+            data.query = "SELECT photo FROM photo ORDER BY photo = 'neu_1', photo"
+            response = check_answer_correct_api(request, data)
+        self.assertFalse(response.correct)
+        self.assertEqual(response.user_result.miss_rows, [])
+
+        # json has no equality operator
+        m.Solution.objects.filter(exercise__enumber=3).update(
+            sql="SELECT json_build_object('photo', photo) AS photo FROM photo"
+        )
+        m.Exercise.objects.filter(enumber=3).update(check_order=False)
+        catalog.invalidate()
+        data.query = """SELECT json_build_object('photo', photo) AS photo
+            FROM photo ORDER BY date"""
+        self.assertTrue(check_answer_correct_api(request, data).correct)
+
+    @override_settings(PG_STUD_CHECK_MODE="rollback")
+    def test_check_answer_correct_rollback(self):
+        self.test_check_answer_correct()
+
+    @override_settings(PG_STUD_CHECK_MODE="rollback")
+    def test_check_answer_read_only(self):
+        data = QueryIn(topic_short="pc", enumber=3, query="DELETE FROM photo;")
+        request = self.factory.post("/api/pg-stud/check_answer_correct/", data.dict())
+        request.user = self.user
+
+        response = check_answer_correct_api(request, data)
+        self.assertFalse(response.correct)
+        self.assertIn("error_in_query", response.user_result.result[0])
+
+        with PgConnPool().connection(self.user) as conn:
+            conn.execute("SET search_path TO pc;")
+            self.assertEqual(
+                conn.execute("SELECT count(*) FROM photo").fetchone(), (5,)
+            )
+
     def test_solution_result(self):
         data = ExerciseSpeciIn(topic_short="pc", enumber="3")
         request = self.factory.post("/api/pg-stud/solution_result/", data.dict())
@@ -228,10 +813,73 @@ class PgStudTestCase(TestCase):
                 "result": [{"date": "20.03.2005"}],
                 "miss_cols": [],
                 "miss_rows": [],
+                "truncated": False,
             }
         }
         self.assertDictEqual(response_dict, expected_data)
 
+    def test_solution_result_cached(self):
+        data = ExerciseSpeciIn(topic_short="pc", enumber=3)
+        request = self.factory.post("/api/pg-stud/solution_result/", data.dict())
+        request.user = self.user
+
+        solution_result(request, data)
+        before = metrics.counters()
+        response = solution_result(request, data)
+        after = metrics.counters()
+        self.assertEqual(after["solution_cached"] - before["solution_cached"], 1)
+        self.assertEqual(response.result.result, [{"date": "20.03.2005"}])
+
+        # a changed solution is executed again
+        solution = m.Solution.objects.get(exercise__enumber=3, snumber=1)
+        solution.sql = "SELECT '21.03.2005' AS date"
+        solution.save()
+        response = solution_result(request, data)
+        self.assertEqual(response.result.result, [{"date": "21.03.2005"}])
+        self.assertTrue(SolutionResult.objects.filter(exercise__enumber=3).exists())
+
+        # other limits give other results
+        topic = m.Topic.objects.get(short="pc")
+        exercise = m.Exercise.objects.get(topic=topic, enumber=3)
+        key = result_key(topic, exercise, solution)
+        topic.max_rows = 1
+        self.assertNotEqual(result_key(topic, exercise, solution), key)
+
+    def test_solution_result_not_from_student_session(self):
+        topic = m.Topic.objects.get(short="pc")
+        exercise = m.Exercise.objects.get(topic=topic, enumber=3)
+        solution = m.Solution.objects.get(exercise=exercise, snumber=1)
+        solution.sql = "SELECT 1 / 3::float8 AS third"
+        solution.save()
+        catalog.invalidate()
+        with PgConnPool().connection(self.user) as conn:
+            try:
+                # changes the rows of the solution in the student's session
+                execute(conn, "SET extra_float_digits = -10", topic)
+                execute(conn, "CREATE TEMP TABLE photo ()", topic)
+                self.assertEqual(
+                    execute(conn, solution.sql, topic), [{"third": 0.33333}]
+                )
+                result = get_solution_result(conn, topic, exercise)
+            finally:
+                conn.execute("RESET extra_float_digits; DROP TABLE pg_temp.photo;")
+                conn.commit()
+        self.assertEqual(result, [{"third": 1 / 3}])
+
+    def test_solution_result_failure_not_cached(self):
+        data = ExerciseSpeciIn(topic_short="pc", enumber=3)
+        request = self.factory.post("/api/pg-stud/solution_result/", data.dict())
+        request.user = self.user
+
+        solution = m.Solution.objects.get(exercise__enumber=3, snumber=1)
+        solution.sql = "SELECT pg_sleep(1)"
+        solution.save()
+        m.Exercise.objects.filter(pk=solution.exercise_id).update(statement_timeout=10)
+        catalog.invalidate()
+        response = solution_result(request, data)
+        self.assertIn("query_timeout", response.result.result[0])
+        self.assertFalse(SolutionResult.objects.filter(exercise__enumber=3).exists())
+
     def test_execute_duplicate_columns(self):
         # Create request and input data
         data = QueryIn(
@@ -259,11 +907,477 @@ class PgStudTestCase(TestCase):
                 ],
                 "miss_cols": [],
                 "miss_rows": [],
+                "truncated": False,
             }
         }
         self.assertDictEqual(response_dict, expected_response)
 
 
+@override_settings(PG_STUD_RESET_MODE="template", PG_STUD_THREADS=0)
+class SchemaTemplateTestCase(TestCase):
+    fixtures = [
+        "common_test.yaml",
+        "pc_test.yaml",
+    ]
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        settings.MEDIA_ROOT = settings.BASE_DIR / "exercises/fixtures/"
+        self.user = LTIUser.objects.create_user(username="mitro", password="testpw")
+        # the catalog may have been loaded before a rollback
+        catalog.invalidate()
+
+    def query(self, query: str, enumber=1):
+        data = QueryIn(topic_short="pc", enumber=enumber, query=query)
+        request = self.factory.post("/api/pg-stud/execute_query/", data.dict())
+        request.user = self.user
+        return execute_query(request, data).result.result
+
+    def test_reset_db_from_template(self):
+        self.query("delete from photo")
+        self.assertEqual(self.query("select count(*) from photo"), [{"count": 0}])
+
+        data = ExerciseSpeciIn(topic_short="pc", enumber=1)
+        request = self.factory.post("/api/pg-stud/reset_db/", data.dict())
+        request.user = self.user
+        reset_db(request, data)
+
+        self.assertEqual(self.query("select count(*) from photo"), [{"count": 5}])
+        template = snapshot_chain(m.Topic.objects.get(short="pc"))[0][0]
+        self.assertEqual(
+            self.query(
+                f"select count(*) from pg_namespace where nspname = '{template}'"
+            ),
+            [{"count": 1}],
+        )
+
+    def reset(self, enumber: int):
+        data = ExerciseSpeciIn(topic_short="pc", enumber=enumber)
+        request = self.factory.post("/api/pg-stud/reset_db/", data.dict())
+        request.user = self.user
+        reset_db(request, data)
+
+    def test_snapshot_per_exercise(self):
+        topic = m.Topic.objects.get(short="pc")
+        for enumber in [4, 5, 6]:
+            m.Exercise.objects.create(
+                topic=topic,
+                enumber=enumber,
+                title="delete",
+                question="delete",
+                is_select=False,
+                eval_statement="SELECT true",
+            )
+        solution = m.Solution.objects.create(
+            exercise=m.Exercise.objects.get(topic=topic, enumber=4),
+            snumber=1,
+            sql="delete from photo where photo = 'nb02'",
+        )
+        m.Solution.objects.create(
+            exercise=m.Exercise.objects.get(topic=topic, enumber=5),
+            snumber=1,
+            sql="delete from photo where photo = 'nb01'",
+        )
+        snapshots = "select count(*) from pg_namespace where nspname like '_tpl_pc_%'"
+
+        self.reset(4)
+        self.assertEqual(self.query("select count(*) from photo"), [{"count": 5}])
+        self.reset(6)
+        self.assertEqual(self.query("select count(*) from photo"), [{"count": 3}])
+        # template and snapshot after exercise 5, built from the template
+        self.assertEqual(self.query(snapshots), [{"count": 2}])
+
+        # changed solution invalidates all following snapshots
+        solution.sql = "delete from photo where photo = 'neu_1'"
+        solution.save()
+        self.reset(5)
+        self.assertEqual(
+            self.query("select photo from photo where photo = 'neu_1'"),
+            [{"photo": ""}],
+        )
+        self.assertEqual(self.query(snapshots), [{"count": 2}])
+
+    def test_clone_schema(self):
+        source, target = "_tpl_clone_test", "clone_test"
+        constraints = """SELECT conname FROM pg_constraint
+            WHERE connamespace = %s::regnamespace ORDER BY conname"""
+        with PgConnPool().connection(self.user) as conn:
+            try:
+                conn.execute(
+                    f"""CREATE SCHEMA {source};
+                    SET search_path TO {source};
+                    CREATE TABLE a (id serial CONSTRAINT a_id PRIMARY KEY,
+                        name text CHECK (name <> ''));
+                    CREATE TABLE b (id int GENERATED ALWAYS AS IDENTITY,
+                        a int CONSTRAINT b_a_fk REFERENCES a,
+                        twice int GENERATED ALWAYS AS (a * 2) STORED);
+                    CREATE INDEX b_a_idx ON b (a);
+                    CREATE VIEW ab AS
+                        SELECT a.name, b.twice FROM a JOIN b ON a.id = b.a;
+                    INSERT INTO a (name) VALUES ('x'), ('y');
+                    INSERT INTO b (a) VALUES (1), (2), (2);"""
+                )
+                conn.commit()
+
+                conn.execute(clone_script(conn, source, target))
+                conn.commit()
+
+                for table in ["a", "b", "ab"]:
+                    self.assertEqual(
+                        conn.execute(f"SELECT * FROM {source}.{table}").fetchall(),
+                        conn.execute(f"SELECT * FROM {target}.{table}").fetchall(),
+                    )
+                self.assertEqual(
+                    conn.execute(constraints, (source,)).fetchall(),
+                    conn.execute(constraints, (target,)).fetchall(),
+                )
+                self.assertEqual(
+                    conn.execute(
+                        "SELECT to_regclass(%s) IS NOT NULL", (f"{target}.b_a_idx",)
+                    ).fetchone(),
+                    (True,),
+                )
+                # sequences continue where the template stopped
+                conn.execute(f"INSERT INTO {target}.a (name) VALUES ('z')")
+                conn.execute(f"INSERT INTO {target}.b (a) VALUES (3)")
+                self.assertEqual(
+                    conn.execute(
+                        f"SELECT max(a.id), max(b.id) FROM {target}.a, {target}.b"
+                    ).fetchone(),
+                    (3, 4),
+                )
+            finally:
+                conn.rollback()
+                conn.execute(f"DROP SCHEMA IF EXISTS {source}, {target} CASCADE")
+                conn.commit()
+
+    def test_snapshot_owned_by_service(self):
+        topic = m.Topic.objects.get(short="pc")
+        chain = snapshot_chain(topic)
+        snapshot = chain[0][0]
+        admin = psycopg.connect(**settings.PG_TEST_CONNINFO, autocommit=True)
+        self.addCleanup(admin.close)
+        admin.execute("CREATE ROLE role_tpl LOGIN")
+        admin.execute(f"GRANT CREATE ON DATABASE {admin.info.dbname} TO role_tpl")
+        self.addCleanup(admin.execute, "DROP OWNED BY role_tpl; DROP ROLE role_tpl")
+
+        conn = StudentConnection.connect(
+            **settings.PG_TEST_CONNINFO | {"user": "role_tpl"}
+        )
+        self.addCleanup(conn.close)
+        conn.schema_prefix = "role_tpl_"
+        # snapshot of an earlier version built by the student
+        admin.execute(f"DROP SCHEMA IF EXISTS {snapshot} CASCADE")
+        conn.execute(f"CREATE SCHEMA {snapshot}")
+        conn.commit()
+
+        self.assertTrue(restore_snapshot(conn, topic, chain, 0))
+        self.assertEqual(
+            conn.execute("SELECT count(*) FROM role_tpl_pc.photo").fetchone(), (5,)
+        )
+        owner = admin.execute(
+            "SELECT nspowner::regrole::text FROM pg_namespace WHERE nspname = %s",
+            (snapshot,),
+        ).fetchone()
+        self.assertEqual(owner, (settings.PG_TEST_CONNINFO["user"],))
+        # the student can only read the snapshot
+        for statement in [
+            f"DELETE FROM {snapshot}.photo",
+            f"CREATE TABLE {snapshot}.photo2 ()",
+            f"DROP SCHEMA {snapshot} CASCADE",
+        ]:
+            with self.assertRaises(psycopg.errors.InsufficientPrivilege):
+                conn.execute(statement)
+            conn.rollback()
+
+
+class ComparisonTestCase(SimpleTestCase):
+    def rows(self, *values):
+        return [{"a": v, "b": [v]} for v in values]
+
+    def test_missing_rows_counts_duplicates(self):
+        self.assertEqual(missing_rows(self.rows(1, 1, 2, 1), self.rows(1, 2)), [1, 3])
+        self.assertEqual(missing_rows(self.rows(1, 2), self.rows(1, 1, 2, 1)), [])
+        self.assertEqual(missing_rows([{"b": 1, "a": 2}], [{"a": 2, "b": 1}]), [])
+
+    def test_check_results_order(self):
+        exercise = m.Exercise(check_order=True)
+        user = Result(result=self.rows(2, 1))
+        solution = Result(result=self.rows(1, 2))
+        self.assertFalse(check_results(user, solution, exercise))
+        self.assertEqual(user.miss_rows + solution.miss_rows, [])
+        exercise.check_order = False
+        self.assertTrue(check_results(user, solution, exercise))
+
+    @tag("slow")
+    def test_benchmark_linear(self):
+        """Compares shuffled results of growing size, the time per row must not
+        grow like it would for a quadratic comparison."""
+        per_row = {}
+        for size in (2_500, 40_000):
+            user = [{"id": i, "name": f"row {i}"} for i in range(size)]
+            solution = Result(result=user[::-1])
+            start = time.perf_counter()
+            check_results(Result(result=user), solution, m.Exercise())
+            per_row[size] = (time.perf_counter() - start) / size
+        self.assertLess(per_row[40_000], per_row[2_500] * 4, per_row)
+        self.assertLess(per_row[40_000], 1e-4, per_row)
+
+
+class ConcurrencyTestCase(SimpleTestCase):
+    @override_settings(PG_STUD_THREADS=4)
+    def test_offload(self):
+        @offload
+        def view(request):
+            time.sleep(0.2)
+            return threading.current_thread().name
+
+        async def concurrently():
+            return await asyncio.gather(view(None), view(None))
+
+        start = time.perf_counter()
+        names = async_to_sync(concurrently)()
+        self.assertLess(time.perf_counter() - start, 0.35)
+        self.assertTrue(all(name.startswith("pg_stud") for name in names))
+
+    def test_broker(self):
+        @offload
+        def view(request, fail=False, sleep=0):
+            if fail:
+                raise Http404("missing")
+            time.sleep(sleep)
+            return threading.current_thread().name
+
+        path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+        listener = Listener(path, family="AF_UNIX", authkey=authkey())
+        self.addCleanup(listener.close)
+        threading.Thread(target=serve, args=(listener,), daemon=True).start()
+
+        request = MagicMock()
+        request.user.pk = 1
+        with self.settings(PG_STUD_BROKER=path, PG_STUD_THREADS=2):
+            name = async_to_sync(view)(request)
+            with self.assertRaises(Http404):
+                async_to_sync(view)(request, fail=True)
+        self.assertTrue(name.startswith("pg_stud_broker"))
+
+        with self.settings(PG_STUD_BROKER=path + "-missing", PG_STUD_THREADS=0):
+            with self.assertRaises(PoolTimeout):
+                async_to_sync(view)(request)
+            self.assertEqual(self.client.get("/api/pg-stud/ready/").status_code, 503)
+
+        # a late answer is not taken for the next one
+        with self.settings(
+            PG_STUD_BROKER=path, PG_STUD_BROKER_TIMEOUT=0.1, PG_STUD_THREADS=0
+        ):
+            with self.assertRaises(PoolTimeout):
+                async_to_sync(view)(request, sleep=0.3)
+            self.assertTrue(async_to_sync(view)(request).startswith("pg_stud_broker"))
+
+        # the warm-up and the readiness check use the pools of the broker
+        with self.settings(PG_STUD_BROKER=path, PG_STUD_THREADS=0):
+            threads = []
+            with patch("pg_stud.api.warm_up") as warm_up_:
+                warm_up_.side_effect = lambda user: threads.append(
+                    threading.current_thread().name
+                )
+                api.warm_up_student(request)
+            self.assertEqual(len(threads), 1)
+            self.assertTrue(threads[0].startswith("pg_stud_broker"))
+            with patch.object(PgConnPool, "is_available", return_value=False):
+                response = self.client.get("/api/pg-stud/ready/")
+            self.assertEqual(response.status_code, 503)
+
+    def test_single_flight(self):
+        flight: SingleFlight[int] = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def slow():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return len(calls)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(flight.run("key", slow)))
+            for _ in range(2)
+        ]
+        threads[0].start()
+        started.wait()
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1, 1])
+        self.assertEqual(flight.run("key", slow), 2)
+
+    def test_async_auth(self):
+        response = self.client.post(
+            "/api/pg-stud/reset_db/", {"topic_short": "pc", "enumber": 1}
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class AdmissionTestCase(SimpleTestCase):
+    def test_token_bucket(self):
+        with patch("pg_stud.admission.time.monotonic", return_value=0):
+            bucket = TokenBucket(rate=2, burst=2)
+            self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0.5])
+        with patch("pg_stud.admission.time.monotonic", return_value=0.25):
+            self.assertEqual(bucket.take(), 0.25)
+        with patch("pg_stud.admission.time.monotonic", return_value=10):
+            self.assertTrue(bucket.is_full())
+
+    def test_token_bucket_without_burst(self):
+        with patch("pg_stud.admission.time.monotonic", return_value=0):
+            bucket = TokenBucket(rate=2, burst=0)
+            self.assertEqual([bucket.take(), bucket.take()], [0, 0.5])
+        with patch("pg_stud.admission.time.monotonic", return_value=0.5):
+            self.assertEqual(bucket.take(), 0)
+
+    @override_settings(
+        PG_STUD_ADMISSION={"query": {"concurrency": 1, "rate": 0, "burst": 0}}
+    )
+    def test_concurrency(self):
+        @admit("query")
+        async def view(request):
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        async def concurrently():
+            return await asyncio.gather(
+                view(request), view(request), return_exceptions=True
+            )
+
+        request = MagicMock()
+        first, second = async_to_sync(concurrently)()
+        self.assertEqual(first, "ok")
+        self.assertIsInstance(second, Throttled)
+        # the slot is free again
+        self.assertEqual(async_to_sync(view)(request), "ok")
+
+
+class ScriptCacheTestCase(SimpleTestCase):
+    def topic(self, short: str, text: str) -> MagicMock:
+        topic = MagicMock(short=short)
+        topic.datamodel_script.path = os.path.join(self.dir, f"{short}.sql")
+        with open(topic.datamodel_script.path, "w") as file:
+            file.write(text)
+        return topic
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def test_script_cache(self):
+        cache = ScriptCache()
+        topic = self.topic("a", "CREATE TABLE t (a int); INSERT INTO t VALUES (1);")
+        script = cache.get(topic)
+        self.assertIs(cache.get(topic), script)
+        self.assertEqual(len(script.statements), 2)
+
+        # a changed file is read again
+        self.topic("a", "CREATE TABLE t (a int, b int);")
+        self.assertEqual(cache.get(topic).text, "CREATE TABLE t (a int, b int);")
+        script = cache.get(topic)
+        cache.invalidate("a")
+        self.assertIsNot(cache.get(topic), script)
+
+    @override_settings(PG_STUD_SCRIPT_CACHE_BYTES=250)
+    def test_eviction(self):
+        cache = ScriptCache()
+        first = self.topic("a", "SELECT 1;" * 4)
+        second = self.topic("b", "SELECT 2;" * 4)
+        script = cache.get(first)
+        cache.get(second)
+        self.assertIs(cache.get(first), script)
+        # the least recently used script is evicted
+        cache.get(self.topic("c", "SELECT 3;" * 4))
+        self.assertIs(cache.get(first), script)
+        self.assertNotIn("b", cache._scripts)
+
+
+class ShardingTestCase(SimpleTestCase):
+    def test_hash_ring(self):
+        students = [f"student{i}" for i in range(1000)]
+        three = HashRing(("a", "b", "c"))
+        four = HashRing(("a", "b", "c", "d"))
+        before = {s: next(three.hosts(s)) for s in students}
+        after = {s: next(four.hosts(s)) for s in students}
+
+        self.assertEqual(sorted(three.hosts("student0")), ["a", "b", "c"])
+        self.assertLess(max(Counter(before.values()).values()), 450)
+        # only students of the new host move
+        moved = [s for s in students if before[s] != after[s]]
+        self.assertTrue(all(after[s] == "d" for s in moved))
+        self.assertLess(len(moved), 400)
+
+    @override_settings(DEPLOY=True, PG_STUD_HOSTS=["a", "b"], PG_STUD_DRAIN=["a"])
+    def test_route(self):
+        pools = PgConnPool()
+        ring = HashRing(("a", "b"))
+        students = {f"student{i}": next(ring.hosts(f"student{i}")) for i in range(20)}
+        self.assertEqual(set(students.values()), {"a", "b"})
+        for student, host in students.items():
+            if host == "b":
+                self.assertEqual(pools.route(student), "b")
+            else:
+                # not sent to a host without the student's database
+                with self.assertRaises(PoolTimeout):
+                    pools.route(student)
+        self.assertTrue(pools.is_available())
+
+        pools.breaker("b").is_open = True
+        self.addCleanup(setattr, pools.breaker("b"), "is_open", False)
+        student = next(s for s, host in students.items() if host == "b")
+        with self.assertRaises(PoolTimeout):
+            pools.route(student)
+        self.assertFalse(pools.is_available())
+
+
+class BreakerTestCase(SimpleTestCase):
+    @override_settings(PG_STUD_BREAKER_FAILURES=2, PG_STUD_BREAKER_PROBE=0.05)
+    def test_breaker(self):
+        breaker = CircuitBreaker(lambda: settings.PG_TEST_CONNINFO)
+        # a busy pool of an available host
+        for _ in range(2):
+            with self.assertRaises(PoolTimeout), breaker.guard():
+                raise PoolTimeout()
+        self.assertFalse(breaker.is_open)
+        for _ in range(2):
+            with self.assertRaises(psycopg.OperationalError), breaker.guard():
+                raise psycopg.OperationalError()
+        self.assertTrue(breaker.is_open)
+
+        # closed by the probe
+        for _ in range(20):
+            if not breaker.is_open:
+                break
+            time.sleep(0.05)
+        self.assertFalse(breaker.is_open)
+
+    @override_settings(PG_STUD_BREAKER_FAILURES=1, PG_STUD_BREAKER_PROBE=60)
+    def test_breaker_unavailable_host(self):
+        breaker = CircuitBreaker(lambda: settings.PG_TEST_CONNINFO | {"port": 1})
+        with self.assertRaises(PoolTimeout), breaker.guard():
+            raise PoolTimeout()
+        self.assertTrue(breaker.is_open)
+
+    def test_ready(self):
+        self.assertEqual(self.client.get("/api/pg-stud/ready/").status_code, 200)
+        pools = PgConnPool()
+        breaker = pools.breaker(pools.hosts()[0])
+        breaker.is_open = True
+        self.addCleanup(setattr, breaker, "is_open", False)
+        self.assertEqual(self.client.get("/api/pg-stud/ready/").status_code, 503)
+
+
+@override_settings(
+    PG_STUD_THREADS=0,
+    PG_STUD_ADMISSION={
+        kind: {"concurrency": 0, "rate": 0, "burst": 0} for kind in ("query", "check")
+    },
+)
 class AllExercises(TestCase):
     fixtures = list(
         map(
@@ -277,6 +1391,8 @@ class AllExercises(TestCase):
         self.factory = RequestFactory()
         self.maxDiff = None
         self.user = LTIUser.objects.create_user(username="mitro", password="testpw")
+        # the catalog may have been loaded before a rollback
+        catalog.invalidate()
 
     def check_answer(self, e: m.Exercise):
         data = QueryIn(
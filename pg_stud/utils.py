@@ -2,64 +2,199 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import logging
 from collections import Counter
-from itertools import chain
+from contextlib import closing, nullcontext
 from typing import Any, Dict, Iterable, List, Optional
 
 # disabled because C compiler is needed for install for better performance uncomment
 # import psycopg_c
+import sqlparse
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
-from psycopg import DatabaseError, ProgrammingError, rows, sql
+from psycopg import DatabaseError, ProgrammingError, Rollback, rows, sql
 from psycopg.connection import Connection
 from psycopg.cursor import BaseCursor, Cursor
+from psycopg.errors import (
+    DuplicateSchema,
+    InvalidSchemaName,
+    UndefinedTable,
+    error_from_result,
+)
+from psycopg.pq import ExecStatus, TransactionStatus
+from psycopg.pq.abc import PGresult
 
 from exercises import models as m
+from exercises.catalog import get_catalog
 from ltiapi.models import LTIUser
+from pg_stud import metrics
+from pg_stud.bulk_load import load_script
+from pg_stud.pg_conn_pool import PgConnPool
+from pg_stud.resources import TIMEOUTS, set_resources
+from pg_stud.schema_templates import (
+    restore_snapshot,
+    script_digest,
+    snapshot_chain,
+    snapshot_index,
+)
+from pg_stud.state import (
+    commit_written,
+    forget_installed,
+    get_installed,
+    get_state,
+    mark_clean,
+    mark_dirty,
+    set_installed,
+)
+from pg_stud.tenancy import schema_name
+
+NO_RESULT = "the last operation didn't produce a result"
 
 
 def set_search_path(cursor: Cursor, topic: m.Topic) -> None:
-    """Sets cursor's search_path to the schema of the topic"""
-    # Reset by default after session end
+    """Sets cursor's search_path to the schema of the topic.
+    Set with every query, as students can change it in ways which can't be
+    told from their queries, e.g. with a function calling set_config.
+    Temporary tables come last, so they can't shadow the tables of the topic
+    in scripts and solutions."""
     cursor.execute(
-        sql.SQL("SET search_path TO {};").format(sql.Identifier(topic.short))
+        sql.SQL("SET search_path TO {}, pg_temp;").format(
+            sql.Identifier(schema_name(cursor.connection, topic))
+        )
     )
 
 
 def is_installed(conn: Connection, topic: m.Topic) -> bool:
     """Checks if the schema of the topic is install on the user database
+    Only schemas known to be missing by the registry are not looked up, as
+    students can drop their schemas themselves, see state.
     Args:
         conn: Connection with autocommit off
     """
-    query = """SELECT EXISTS(SELECT 1 FROM information_schema.schemata
-                 WHERE schema_name = %s);"""
+    registered = get_installed(conn, topic)
+    if registered is False:
+        return False
+    installed = schema_exists(conn, topic)
+    conn.commit()
+    if installed != registered:
+        set_installed(conn, topic, installed)
+    return installed
+
+
+def schema_exists(conn: Connection, topic: m.Topic) -> bool:
+    """Asks the student database if the schema of the topic exists"""
     with conn.cursor() as cursor:
-        cursor.execute(query, (topic.short,))
-        conn.commit()
-        result = cursor.fetchone()
-        return result[0]  # type: ignore
+        cursor.execute(
+            "SELECT to_regnamespace(%s) IS NOT NULL;",
+            (sql.Identifier(schema_name(conn, topic)).as_string(conn),),
+        )
+        return cursor.fetchone()[0]  # type: ignore
 
 
 def install_db(cursor: Cursor, topic: m.Topic) -> None:
     """Installs the topic's linked script by executing it in a schema named after
     the topic"""
-    cursor.execute(sql.SQL("CREATE SCHEMA {};").format(sql.Identifier(topic.short)))
+    schema = schema_name(cursor.connection, topic)
+    cursor.execute(sql.SQL("CREATE SCHEMA {};").format(sql.Identifier(schema)))
     set_search_path(cursor, topic)
-    with open(topic.datamodel_script.path) as script:
-        cursor.execute(script.read())
+    load_script(cursor, topic)
+    set_installed(cursor.connection, topic, True)
 
 
 def uninstall_db(cursor: Cursor, topic: m.Topic) -> None:
-    """Uninstalls the topic schema by droping it."""
+    """Uninstalls the topic schema by droping it if it exists."""
+    schema = schema_name(cursor.connection, topic)
     cursor.execute(
-        sql.SQL("DROP SCHEMA {} CASCADE").format(sql.Identifier(topic.short))
+        sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema))
     )
+    set_installed(cursor.connection, topic, False)
+
+
+def ensure_installed(conn: Connection, topic: m.Topic) -> bool:
+    """Installs the topic schema if it is not installed yet.
+
+    Returns:
+        True if the schema was installed by this call.
+    """
+    conn.autocommit = False  # let script decide when to commit
+
+    if is_installed(conn, topic):
+        return False
+
+    with conn.cursor() as cursor:
+        try:
+            install_db(cursor, topic)
+        except DuplicateSchema:
+            # installed without the registry knowing
+            conn.rollback()
+            set_installed(conn, topic, True)
+            return False
+        conn.commit()
+    return True
+
+
+def warm_up(user: LTIUser) -> None:
+    """Opens the user's pool before the first query. With PG_STUD_WARM_UP
+    "install" the schemas of all visible topics are installed as well."""
+    try:
+        with PgConnPool().connection(user) as conn:
+            if settings.PG_STUD_WARM_UP == "install":
+                for topic in get_catalog().topics.values():
+                    if topic.visible:
+                        ensure_installed(conn, topic)
+    except Exception:
+        logging.exception("warm up of %s failed", user.lms_username)
 
 
-def execute(conn: Connection, query: str, topic: m.Topic) -> List[Dict[str, Any]]:
+class Rows(List[Dict[str, Any]]):
+    """Rows of a query result.
+    truncated is set if not all rows were fetched because of the limits."""
+
+    truncated = False
+
+
+def is_single_statement(query: str) -> bool:
+    """Checks if the query is a single statement.
+    Only single statements can be prepared or sent in pipeline mode.
+    """
+    return len(sqlparse.split(query)) == 1
+
+
+def is_read_only(statements: List[str]) -> bool:
+    """Checks if the statements are SELECTs without data modifying parts.
+    Functions writing to the database are not detected."""
+    for statement in sqlparse.parse("\n".join(statements)):
+        if statement.get_type() != "SELECT":
+            return False
+        if any(
+            token.ttype is sqlparse.tokens.DML and token.normalized != "SELECT"
+            for token in statement.flatten()
+        ):
+            return False
+    return True
+
+
+def execute(
+    conn: Connection,
+    query: str,
+    topic: m.Topic,
+    savepoint=False,
+    exercise: Optional[m.Exercise] = None,
+) -> Rows:
     """Executes a query on the connection.
+    Setting the search_path and resource settings and committing are sent in
+    pipeline mode, the rows are fetched within the limits of the topic, see
+    fetch.
+
+    Args:
+        savepoint: Run the query in a savepoint of the current transaction
+          instead of committing it. Errors only roll back the savepoint.
+        exercise: Exercise whose resource settings are used instead of the
+          topic's
 
     Returns:
         If the query has an error [{'error_in_query': e.args}] is returned.
+        If the query was too slow [{'query_timeout': e.args}] is returned.
         For non-SELECT-like queries which do not produce output
           [{'no_output': e.args}] is returned.
         When no row is returned because there was no entry found a list with a
@@ -71,32 +206,163 @@ def execute(conn: Connection, query: str, topic: m.Topic) -> List[Dict[str, Any]
         >>> execute(conn, "SELECT * FROM table where column1='not_exists'")
         [{"column1": "", "column2": ""}]
     """
-    with conn.cursor(row_factory=dict_row) as cursor:
+    statements = sqlparse.split(query)
+    single = len(statements) == 1
+    with conn.cursor(row_factory=dict_row) as cursor, conn.cursor() as setup:
         try:
-            set_search_path(cursor, topic)
-            cursor.execute(query)
-            conn.commit()
-            result = cursor.fetchall()
-            if result == []:
-                # When no row is returned because there was no entry found
-                return [{col.name: "" for col in cursor.description}]
-            return result
+            if savepoint:
+                with conn.transaction():
+                    with conn.pipeline():
+                        set_search_path(setup, topic)
+                        set_resources(setup, topic, exercise)
+                    result = fetch(conn, cursor, statements, topic)
+                    if conn.info.transaction_status == TransactionStatus.INERROR:
+                        raise Rollback()  # cancelled at the limits
+                if conn.info.transaction_status != TransactionStatus.INTRANS:
+                    mark_dirty(conn, topic)  # query ended the transaction
+            else:
+                with conn.pipeline():
+                    set_search_path(setup, topic)
+                    set_resources(setup, topic, exercise)
+                result = fetch(conn, cursor, statements, topic)
+                if conn.info.transaction_status == TransactionStatus.INERROR:
+                    conn.rollback()  # cancelled at the limits
+                elif commit_written(conn):
+                    mark_dirty(conn, topic)
+        except TIMEOUTS as e:
+            recover(conn, topic, savepoint, single)
+            return Rows([{"query_timeout": e.args}])
         except ProgrammingError as e:
-            # For statements like 'CREATE TABLE' which do not produce a result
-            return [{"no_output": e.args}]
+            recover(conn, topic, savepoint, single)
+            if isinstance(e, (UndefinedTable, InvalidSchemaName)):
+                reconcile(conn, topic)
+            return Rows([{"no_output": e.args}])
         except DatabaseError as e:
             # error messages should always be english.
-            return [{"error_in_query": e.args}]
+            recover(conn, topic, savepoint, single)
+            return Rows([{"error_in_query": e.args}])
+
+    if result is None:
+        # For statements like 'CREATE TABLE' which do not produce a result
+        return Rows([{"no_output": (NO_RESULT,)}])
+    return result
+
+
+def fetch(
+    conn: Connection, cursor: Cursor, statements: List[str], topic: m.Topic
+) -> Optional[Rows]:
+    """Executes the statements one by one and fetches the rows of the first
+    until the row or byte limit of the topic is reached. The rows are
+    streamed, so no result is held in memory as a whole.
+    Read only queries are cancelled at the limits, which aborts the
+    transaction. Other queries are run to the end and only the rows after the
+    limits are dropped, as cancelling would roll back their changes.
+
+    Returns:
+        None if the first statement does not produce a result
+    """
+    max_rows = topic.max_rows or settings.PG_STUD_MAX_ROWS
+    max_bytes = topic.max_bytes or settings.PG_STUD_MAX_BYTES
+    read_only = is_read_only(statements)
+    result = Rows()
+    produced = bool(statements)
+    size = 0
+    for i, statement in enumerate(statements):
+        try:
+            with closing(cursor.stream(statement)) as rows:
+                for row in rows:
+                    if i or result.truncated:
+                        continue
+                    size += row_size(cursor.pgresult)
+                    if len(result) == max_rows or size > max_bytes:
+                        result.truncated = True
+                        if not result:
+                            result.append({c.name: "" for c in cursor.description})
+                        if read_only:
+                            return result
+                        continue
+                    result.append(row)
+        except ProgrammingError as e:
+            if e.sqlstate is not None:
+                raise
+            if not i:
+                produced = False  # the statement succeeded without a result
+        if not i and produced and result == []:
+            # When no row is returned because there was no entry found
+            # A streamed empty result has no description
+            result.append({col: "" for col in describe(conn, statement)})
+    return result if produced else None
+
+
+def row_size(pgresult: Optional[PGresult]) -> int:
+    """Returns the size of the values of the streamed row as received"""
+    if pgresult is None:
+        return 0
+    return sum(
+        len(pgresult.get_value(0, col) or b"") for col in range(pgresult.nfields)
+    )
 
 
-def execute_check(conn: Connection, query: str, topic: m.Topic) -> bool:
+def describe(conn: Connection, query: str) -> List[str]:
+    """Returns the column names of the query without executing it"""
+    encoding = conn.info.encoding
+    prepared = conn.pgconn.prepare(b"", query.encode(encoding))
+    if prepared.status != ExecStatus.COMMAND_OK:
+        raise error_from_result(prepared, encoding=encoding)
+    description = conn.pgconn.describe_prepared(b"")
+    if description.status != ExecStatus.COMMAND_OK:
+        raise error_from_result(description, encoding=encoding)
+    return [
+        description.fname(col).decode(encoding)  # type: ignore
+        for col in range(description.nfields)
+    ]
+
+
+def recover(conn: Connection, topic: m.Topic, savepoint: bool, single: bool):
+    """Makes the connection usable again after a failed query.
+    Multiple statements may have committed before one failed, so the schema
+    is marked dirty then.
+    """
+    if savepoint:
+        if conn.info.transaction_status != TransactionStatus.INTRANS:
+            mark_dirty(conn, topic)
+        return
+    conn.rollback()
+    if not single:
+        mark_dirty(conn, topic)
+
+
+def reconcile(conn: Connection, topic: m.Topic) -> None:
+    """Forgets the installation of the topic schema if it was dropped behind
+    the registry's back. Missing tables are mostly typos, so the student
+    database is asked first."""
+    status = conn.info.transaction_status
+    if status == TransactionStatus.INERROR:
+        return
+    dropped = not schema_exists(conn, topic)
+    if status == TransactionStatus.IDLE:
+        conn.rollback()
+    if dropped:
+        forget_installed(conn, topic)
+        mark_dirty(conn, topic)
+
+
+def execute_check(
+    conn: Connection,
+    query: str,
+    topic: m.Topic,
+    exercise: Optional[m.Exercise] = None,
+) -> bool:
     """Executes queries with only produce a boolean
     If an Exception occurs False is returned.
     """
+    single = is_single_statement(query)
     try:
-        with conn.cursor() as cursor:
-            set_search_path(cursor, topic)
-            cursor.execute(query)
+        with conn.cursor() as cursor, conn.cursor() as setup:
+            with conn.pipeline() if single else nullcontext():
+                set_search_path(setup, topic)
+                set_resources(setup, topic, exercise)
+                cursor.execute(query)
             out = cursor.fetchone()
             assert out is not None
             return out[0]
@@ -121,6 +387,7 @@ def update_user_exercise(
 
 def do_reset_db(conn: Connection, topic: m.Topic, exercise: m.Exercise):
     """Resets db to specific exercise
+    Skipped if the schema was not modified since it was reset to the same state.
 
     Args:
         conn (Connection): Connection, needs to be fresh
@@ -129,24 +396,46 @@ def do_reset_db(conn: Connection, topic: m.Topic, exercise: m.Exercise):
     """
     conn.autocommit = False  # let script decide when to commit
 
+    catalog = get_catalog()
+    changes = [
+        solution
+        for solution in catalog.changes(topic)
+        if solution.exercise.enumber < exercise.enumber
+    ]
+    # snapshots of one student cannot be read by the others
+    template = (
+        settings.PG_STUD_RESET_MODE == "template"
+        and settings.PG_STUD_TENANCY != "shared_database"
+    )
+    if template:
+        chain = snapshot_chain(topic)
+        index = snapshot_index(chain, exercise)
+        snapshot = chain[index][0]
+    else:
+        # any change of the catalog changes its version
+        snapshot = f"{script_digest(topic)}:{catalog.version}:{len(changes)}"
+    metrics.incr("reset_total")
+    if settings.PG_STUD_SKIP_CLEAN_RESETS and get_state(conn, topic) == snapshot:
+        metrics.incr("reset_skipped")
+        return
+
+    if template and restore_snapshot(conn, topic, chain, index):
+        set_installed(conn, topic, True)
+        mark_clean(conn, topic, snapshot)
+        return
+
     with conn.cursor() as cursor:
         # Uninstall
-        if is_installed(conn, topic):
-            uninstall_db(cursor, topic)
-            conn.commit()
+        uninstall_db(cursor, topic)
+        conn.commit()
         # Install
         install_db(cursor, topic)
         conn.commit()
         # Execute past solutions
-        past_solutions = m.Solution.objects.filter(
-            snumber=1,
-            exercise__topic=topic,
-            exercise__enumber__lt=exercise.enumber,
-            exercise__is_select=False,
-        )
-        for solution in past_solutions:
+        for solution in changes:
             execute(conn, solution.sql, topic)
             conn.commit()
+    mark_clean(conn, topic, snapshot)
 
 
 def dict_row(cursor: BaseCursor[Any, Any]) -> rows.RowMaker[rows.DictRow]:
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     "exercises",
     "feedback",
     "ltiapi",
+    "pg_stud",
     # Libraries
     "django_ace",
     "modeltranslation",
@@ -128,6 +129,10 @@ if DEPLOY:
         }
     }
 
+# Seconds a process serves its catalog of topics, exercises, solutions and tags
+# before comparing its version with the shared cache, see exercises.catalog
+CATALOG_CHECK_INTERVAL = float(os.environ.get("CATALOG_CHECK_INTERVAL", 1))
+
 
 # ALLOWED_HOSTS
 ALLOWED_HOSTS = os.environ.get("ALLOWED_HOSTS", "*").split(" ")
@@ -275,6 +280,146 @@ PG_TEST_CONNINFO = {
     "port": os.environ.get("PG_TEST_PORT"),
 }
 
+# Hosts of the student databases as host[:port], separated by commas, default
+# PG_STUD_HOST:PG_STUD_PORT. Students are spread over them by consistent hashing.
+# The students of the hosts in PG_STUD_DRAIN are refused at once, e.g. during a
+# maintenance. Their databases are not moved, so adding a host to PG_STUD_HOSTS
+# needs the students it takes over to be provisioned on it first.
+PG_STUD_HOSTS = os.environ.get(
+    "PG_STUD_HOSTS",
+    f"{os.environ.get('PG_STUD_HOST')}:{os.environ.get('PG_STUD_PORT', 5432)}",
+).split(",")
+PG_STUD_DRAIN = os.environ.get("PG_STUD_DRAIN", "").split(",")
+
+# Budget of connections to the student databases per process. Each user's pool
+# reserves PG_STUD_POOL_SIZE of them, the least recently used idle pool is closed
+# when the budget is used up. Requests wait PG_STUD_POOL_TIMEOUT seconds for a
+# connection, pools unused for PG_STUD_POOL_IDLE seconds are closed.
+PG_STUD_MAX_CONNECTIONS = int(os.environ.get("PG_STUD_MAX_CONNECTIONS", 300))
+PG_STUD_POOL_SIZE = int(os.environ.get("PG_STUD_POOL_SIZE", 3))
+PG_STUD_POOL_TIMEOUT = float(os.environ.get("PG_STUD_POOL_TIMEOUT", 5))
+PG_STUD_POOL_IDLE = float(os.environ.get("PG_STUD_POOL_IDLE", 1200))
+
+# Unix socket of the broker started with "manage.py runbroker", which runs the
+# pg_stud views of all workers with one set of pools. Empty runs them in the
+# workers. Workers wait PG_STUD_BROKER_TIMEOUT seconds for an answer.
+PG_STUD_BROKER = os.environ.get("PG_STUD_BROKER", "")
+PG_STUD_BROKER_TIMEOUT = float(os.environ.get("PG_STUD_BROKER_TIMEOUT", 60))
+
+# Bytes of datamodel scripts cached per process, the least recently used are
+# evicted
+PG_STUD_SCRIPT_CACHE_BYTES = int(
+    os.environ.get("PG_STUD_SCRIPT_CACHE_BYTES", 64 * 1024 * 1024)
+)
+
+# Admission control of the pg_stud views per process. "query" is execute_query
+# and solution_result, "check" is check_answer_correct, reset_db and
+# check_or_install_db. At most "concurrency" views of a kind run at once, every
+# student may send "burst" (at least 1) requests at once and "rate" per second
+# afterwards.
+# Requests over the limits get a 429 with Retry-After, 0 disables a limit.
+PG_STUD_ADMISSION = {
+    "query": {
+        "concurrency": int(os.environ.get("PG_STUD_QUERY_CONCURRENCY", 48)),
+        "rate": float(os.environ.get("PG_STUD_QUERY_RATE", 2)),
+        "burst": int(os.environ.get("PG_STUD_QUERY_BURST", 10)),
+    },
+    "check": {
+        "concurrency": int(os.environ.get("PG_STUD_CHECK_CONCURRENCY", 16)),
+        "rate": float(os.environ.get("PG_STUD_CHECK_RATE", 0.5)),
+        "burst": int(os.environ.get("PG_STUD_CHECK_BURST", 5)),
+    },
+}
+
+# Threads per process running the pg_stud views, 0 runs them in the thread of
+# the sync views. By default as many as the admission control lets views run
+# at once, more would only wait, or PG_STUD_MAX_CONNECTIONS if a concurrency
+# limit is disabled. Each thread reserves 8 MB of virtual memory for its stack,
+# of which only some KB are resident.
+PG_STUD_THREADS = int(
+    os.environ.get(
+        "PG_STUD_THREADS",
+        (
+            sum(kind["concurrency"] for kind in PG_STUD_ADMISSION.values())
+            if all(kind["concurrency"] for kind in PG_STUD_ADMISSION.values())
+            else PG_STUD_MAX_CONNECTIONS
+        ),
+    )
+)
+
+# Circuit breaker: after PG_STUD_BREAKER_FAILURES failed attempts to connect in a
+# row (0 disables) requests fail at once until a ping of the host every
+# PG_STUD_BREAKER_PROBE seconds succeeds
+PG_STUD_BREAKER_FAILURES = int(os.environ.get("PG_STUD_BREAKER_FAILURES", 5))
+PG_STUD_BREAKER_PROBE = float(os.environ.get("PG_STUD_BREAKER_PROBE", 5))
+
+# Warm up on LTI launch in the background:
+#  "off": the pool of the student is opened by the first query
+#  "pool": open the pool of the student
+#  "install": open the pool and install the schemas of all visible topics
+PG_STUD_WARM_UP = os.environ.get("PG_STUD_WARM_UP", "pool")
+
+# Where the schemas of students are:
+#  "database": every student has a database named after the student and a pool
+#   of connections of the student's login role. Schemas are named after the
+#   topics.
+#  "shared_database": all students use the database PG_STUD_SHARED_DB instead,
+#   with one schema per student and topic named "<student>_<topic>" (hashed if
+#   too long). Every student still has a pool of connections of the student's
+#   own login role, which owns the student's schemas. The template reset mode
+#   is not used, snapshots are not shared between roles.
+#  Pools are never shared between students, a student could switch back from
+#  the role a shared connection switched to.
+PG_STUD_TENANCY = os.environ.get("PG_STUD_TENANCY", "database")
+PG_STUD_SHARED_DB = os.environ.get("PG_STUD_SHARED_DB")
+
+# How topic schemas are reset:
+#  "script": drop the schema and replay the datamodel script
+#  "template": clone a snapshot schema of the exercise's state, built once per
+#   version of the script and past solutions
+PG_STUD_RESET_MODE = os.environ.get("PG_STUD_RESET_MODE", "script")
+
+# Login role of the service connections, which build the snapshot schemas of the
+# template reset mode in the student databases. It owns the snapshots, the
+# students' roles can only read them. It needs the CREATE privilege on the
+# student databases. The results of the solutions are computed by it in the
+# database PG_STUD_SERVICE_DB on every host, which students must not be able to
+# connect to. Without DEPLOY the test database is used.
+PG_STUD_SERVICE_USER = os.environ.get("PG_STUD_SERVICE_USER")
+PG_STUD_SERVICE_DB = os.environ.get("PG_STUD_SERVICE_DB")
+
+# Skip resets of schemas which were not modified since they were reset to the
+# same state. The marks are kept in the cache, so it has to be shared by all
+# processes (memcached with DEPLOY). Only writes through pg_stud mark a schema
+# modified, so it must be off if the student databases are written otherwise.
+PG_STUD_SKIP_CLEAN_RESETS = int(os.environ.get("PG_STUD_SKIP_CLEAN_RESETS", DEPLOY))
+
+# How answers are checked:
+#  "reset": reset the schema, then run the user and the solution query
+#  "rollback": run both in a transaction which is rolled back. SELECT exercises
+#   run READ ONLY and only reset schemas modified since their last reset if
+#   PG_STUD_SKIP_CLEAN_RESETS is on.
+PG_STUD_CHECK_MODE = os.environ.get("PG_STUD_CHECK_MODE", "reset")
+
+# How results of SELECT exercises are compared:
+#  "python": fetch both results and compare them in python
+#  "database": compare them in the database with EXCEPT ALL and only fetch
+#   PG_STUD_COMPARE_SAMPLE rows of each result and of the differing rows
+PG_STUD_COMPARE_MODE = os.environ.get("PG_STUD_COMPARE_MODE", "python")
+PG_STUD_COMPARE_SAMPLE = int(os.environ.get("PG_STUD_COMPARE_SAMPLE", 100))
+
+# Limits of query results sent to students, topics can override them
+PG_STUD_MAX_ROWS = int(os.environ.get("PG_STUD_MAX_ROWS", 1000))
+PG_STUD_MAX_BYTES = int(os.environ.get("PG_STUD_MAX_BYTES", 1_000_000))
+
+# Settings of the transactions of student queries, topics and exercises can
+# override them. Timeouts in milliseconds, 0 disables them. Sizes in kilobytes,
+# 0 leaves them to the server.
+PG_STUD_STATEMENT_TIMEOUT = int(os.environ.get("PG_STUD_STATEMENT_TIMEOUT", 10_000))
+PG_STUD_LOCK_TIMEOUT = int(os.environ.get("PG_STUD_LOCK_TIMEOUT", 5_000))
+PG_STUD_WORK_MEM = int(os.environ.get("PG_STUD_WORK_MEM", 0))
+PG_STUD_TEMP_FILE_LIMIT = int(os.environ.get("PG_STUD_TEMP_FILE_LIMIT", 0))
+
 FIXTURE_DIRS = [BASE_DIR / "exercises_data"]
 
 LOGIN_URL = "lti/login-lms"
@@ -15,6 +15,7 @@ from psycopg_pool import PoolTimeout
 
 from exercises.api import router as exercises_router
 from feedback.api import router as feedback_router
+from pg_stud.admission import Throttled
 from pg_stud.api import router as pg_stud_router
 from sql_training.settings import DEPLOY, MEDIA_ROOT, PG_STUD_CONNINFO
 
@@ -45,6 +46,15 @@ def service_unavailable(request, exc):
     )
 
 
+@api.exception_handler(Throttled)
+def too_many_requests(request, exc):
+    response = api.create_response(
+        request, "Too many requests, try again in a moment.", status=429
+    )
+    response["Retry-After"] = exc.retry_after_header
+    return response
+
+
 api.add_router("/", exercises_router)
 api.add_router("pg-stud/", pg_stud_router)
 api.add_router("feedback", feedback_router)